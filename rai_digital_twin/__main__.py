@@ -1,4 +1,7 @@
 from rai_digital_twin.execution_logic import extrapolation_cycle
+from rai_digital_twin.artifacts import ARTIFACT_SUFFIXES, DEFAULT_ARTIFACT_FORMAT
+from rai_digital_twin.retrieve_data import DEFAULT_MAX_WORKERS
+from rai_digital_twin.stochastic import DEFAULT_FIT_METHOD, FIT_METHODS
 import click
 import os
 
@@ -13,10 +16,28 @@ import os
 @click.option('-l', '--use-last-data', 'use_last_data',
               is_flag=True,
               help="Use last retrieved data rather than downloading it")
-def main(use_last_data, past_days, extrapolation_timesteps) -> None:
+@click.option('-w', '--max-workers', 'max_workers',
+              default=DEFAULT_MAX_WORKERS,
+              help="Maximum number of concurrent requests to the subgraph")
+@click.option('-n', '--no-cache', 'no_cache',
+              is_flag=True,
+              help="Download all data rather than reusing the local store at data/cache")
+@click.option('-a', '--artifact-format', 'artifact_format',
+              default=DEFAULT_ARTIFACT_FORMAT,
+              type=click.Choice(list(ARTIFACT_SUFFIXES.keys())),
+              help="File format for the data written at data/runs")
+@click.option('-f', '--fit-method', 'fit_method',
+              default=DEFAULT_FIT_METHOD,
+              type=click.Choice(FIT_METHODS),
+              help="Method for fitting the ETH price distribution. 'advi' and 'nuts' require pymc3")
+def main(use_last_data, past_days, extrapolation_timesteps, max_workers, no_cache, artifact_format, fit_method) -> None:
     extrapolation_cycle(use_last_data=use_last_data,
                         historical_interval=past_days,
-                        extrapolation_timesteps=extrapolation_timesteps)
+                        extrapolation_timesteps=extrapolation_timesteps,
+                        max_workers=max_workers,
+                        use_cache=not no_cache,
+                        artifact_format=artifact_format,
+                        fit_method=fit_method)
 
     # %%
 
@@ -0,0 +1,153 @@
+"""
+artifacts.py
+
+Readers and writers for the tabular artifacts at `data/runs`.
+
+Artifacts can be written as gzip CSV, as Parquet or as Arrow IPC files.
+Parquet and Arrow keep the column dtypes and are much faster to write and
+parse than CSV. Arrow files are written uncompressed, so that they can be
+memory-mapped and consumed without copying them into memory.
+Both columnar formats require `pyarrow`.
+"""
+from os import listdir
+from pathlib import Path
+from typing import Iterator, Union
+import pandas as pd
+from pandas import DataFrame
+
+ARTIFACT_SUFFIXES = {'csv': '.csv.gz',
+                     'parquet': '.parquet',
+                     'arrow': '.arrow'}
+
+DEFAULT_ARTIFACT_FORMAT = 'csv'
+PARQUET_COMPRESSION = 'zstd'
+DEFAULT_CHUNK_SIZE = 50_000
+
+PathLike = Union[str, Path]
+
+
+def artifact_format(path: PathLike) -> str:
+    """
+    Infer the artifact format from a file path.
+    """
+    name = str(path)
+    for (fmt, suffix) in ARTIFACT_SUFFIXES.items():
+        if name.endswith(suffix):
+            return fmt
+    raise ValueError(f"Unknown artifact format for {path}")
+
+
+def artifact_path(base_path: PathLike,
+                  name: str,
+                  fmt: str = DEFAULT_ARTIFACT_FORMAT) -> Path:
+    return Path(base_path) / (name + ARTIFACT_SUFFIXES[fmt])
+
+
+def write_artifact(df: DataFrame,
+                   path: PathLike,
+                   index: bool = False) -> None:
+    """
+    Write a DataFrame on the format given by the path suffix.
+    """
+    fmt = artifact_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, compression='gzip', index=index)
+    elif fmt == 'parquet':
+        df.to_parquet(path, compression=PARQUET_COMPRESSION, index=index)
+    else:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=index)
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+
+def read_artifact_table(path: PathLike, memory_map: bool = True):
+    """
+    Read a columnar artifact as a `pyarrow.Table`. Arrow files are
+    memory-mapped by default, so that the table buffers are backed by the
+    file rather than copied into memory.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    fmt = artifact_format(path)
+    if fmt == 'parquet':
+        return pq.read_table(path, memory_map=memory_map)
+    elif fmt == 'arrow':
+        source = pa.memory_map(str(path)) if memory_map else pa.OSFile(str(path))
+        return pa.ipc.open_file(source).read_all()
+    else:
+        raise ValueError(f"{path} isn't a columnar artifact")
+
+
+def read_artifact(path: PathLike,
+                  memory_map: bool = False,
+                  columns: list[str] = None) -> DataFrame:
+    """
+    Read a artifact written by `write_artifact` as a DataFrame.
+    """
+    fmt = artifact_format(path)
+    if fmt == 'csv':
+        df = pd.read_csv(path, compression='gzip', usecols=columns)
+        return df.loc[:, ~df.columns.str.startswith('Unnamed')]
+    else:
+        table = read_artifact_table(path, memory_map)
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
+
+
+def iter_artifact_chunks(path: PathLike,
+                         columns: list[str] = None,
+                         chunksize: int = DEFAULT_CHUNK_SIZE,
+                         block_range: tuple[int, int] = None) -> Iterator[DataFrame]:
+    """
+    Read a artifact as a sequence of DataFrames with at most `chunksize`
+    rows, so that the whole file is never on memory at once.
+
+    If given, only rows with `block_number` on the half-open `block_range`
+    are returned. On columnar artifacts the filter is pushed down into
+    the reader, so that non-matching row groups are skipped.
+    """
+    fmt = artifact_format(path)
+    if fmt == 'csv':
+        chunks = pd.read_csv(path,
+                             compression='gzip',
+                             usecols=columns,
+                             chunksize=chunksize)
+        for chunk in chunks:
+            chunk = chunk.loc[:, ~chunk.columns.str.startswith('Unnamed')]
+            if block_range is not None:
+                (start, end) = block_range
+                chunk = chunk[(chunk.block_number >= start)
+                              & (chunk.block_number < end)]
+            if len(chunk) > 0:
+                yield chunk
+    else:
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(str(path),
+                             format='parquet' if fmt == 'parquet' else 'ipc')
+        if block_range is not None:
+            (start, end) = block_range
+            block_filter = ((ds.field('block_number') >= start)
+                            & (ds.field('block_number') < end))
+        else:
+            block_filter = None
+        batches = dataset.to_batches(columns=columns,
+                                     filter=block_filter,
+                                     batch_size=chunksize)
+        for batch in batches:
+            if batch.num_rows > 0:
+                yield batch.to_pandas()
+
+
+def find_last_artifact(base_path: PathLike, name: str) -> Path:
+    """
+    Find the most recent artifact of a given kind, eg. 'retrieval',
+    regardless of its format.
+    """
+    files = sorted(file for file in listdir(Path(base_path).expanduser())
+                   if name in file
+                   and any(file.endswith(suffix)
+                           for suffix in ARTIFACT_SUFFIXES.values()))
+    return Path(base_path) / files[-1]
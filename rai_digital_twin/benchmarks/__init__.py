@@ -0,0 +1,5 @@
+"""
+Performance benchmarks for the Reflexer Digital Twin.
+
+Each module is runnable through `python -m rai_digital_twin.benchmarks.<name>`.
+"""
@@ -0,0 +1,83 @@
+"""
+Retrieval throughput benchmark.
+
+Measures how many block heights per second `download_data` retrieves from
+the local subgraph stand-in, for different window sizes and concurrency
+settings.
+"""
+from time import perf_counter
+import click
+import pandas as pd
+
+from rai_digital_twin.retrieve_data import download_data
+from rai_digital_twin.subgraph_stand_in import SubgraphStandIn, find_last_fixture
+from rai_digital_twin.subgraph_stand_in import load_fixture, running_stand_in
+
+
+def benchmark_retrieval(fixture: pd.DataFrame,
+                        window_sizes: list[int],
+                        worker_counts: list[int],
+                        latency: float = 0.05,
+                        error_rate: float = 0.0,
+                        use_system_totals: bool = True) -> pd.DataFrame:
+    """
+    Time `download_data` against the stand-in for every combination of
+    window size (in hours before the last fixture row) and worker count.
+    """
+    stand_in = SubgraphStandIn(fixture)
+    end = fixture.timestamp.max() + pd.Timedelta(seconds=1)
+
+    records = []
+    with running_stand_in(stand_in,
+                          latency=latency,
+                          error_rate=error_rate) as url:
+        for window_size in window_sizes:
+            date_range = (end - pd.Timedelta(hours=window_size), end)
+            for max_workers in worker_counts:
+                t1 = perf_counter()
+                df = download_data(date_range=date_range,
+                                   max_workers=max_workers,
+                                   use_system_totals=use_system_totals,
+                                   subgraph_url=url)
+                t2 = perf_counter()
+                records.append({'window_hours': window_size,
+                                'max_workers': max_workers,
+                                'blocks': len(df),
+                                'seconds': t2 - t1,
+                                'blocks_per_second': len(df) / (t2 - t1)})
+    return pd.DataFrame(records)
+
+
+@click.command()
+@click.option('-f', '--fixture', 'fixture_path',
+              default=None,
+              help="Retrieval file to be served. Defaults to the last one at data/runs")
+@click.option('-w', '--windows', 'windows',
+              default='24,72,168',
+              help="Comma-separated window sizes, in hours")
+@click.option('-c', '--workers', 'workers',
+              default='1,4,16',
+              help="Comma-separated worker counts")
+@click.option('--latency', 'latency',
+              default=0.05,
+              help="Delay in seconds added to every request")
+@click.option('--error-rate', 'error_rate',
+              default=0.0,
+              help="Fraction of requests answered with an error")
+@click.option('--enumerate-safes', 'enumerate_safes',
+              is_flag=True,
+              help="Enumerate SAFEs rather than using the system totals")
+def main(fixture_path, windows, workers, latency, error_rate, enumerate_safes) -> None:
+    if fixture_path is None:
+        fixture_path = find_last_fixture()
+    results = benchmark_retrieval(load_fixture(fixture_path),
+                                  [int(el) for el in windows.split(',')],
+                                  [int(el) for el in workers.split(',')],
+                                  latency,
+                                  error_rate,
+                                  not enumerate_safes)
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
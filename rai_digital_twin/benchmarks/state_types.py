@@ -0,0 +1,116 @@
+"""
+State types allocation benchmark.
+
+Compares the tuple-backed `TokenState`, `ControllerState` and
+`ControllerParams` against equivalent frozen dataclasses on the
+operations done by the model inner loop: construction, arithmetic and the
+deep copies done by cadCAD on every substep.
+"""
+from copy import deepcopy
+from dataclasses import dataclass
+from timeit import Timer
+from typing import Callable
+import tracemalloc
+import click
+import pandas as pd
+
+from rai_digital_twin.types import ControllerParams, ControllerState, TokenState
+
+
+@dataclass(frozen=True)
+class DataclassTokenState():
+    rai_reserve: float
+    eth_reserve: float
+    rai_debt: float
+    eth_locked: float
+
+    def __add__(self, x):
+        return DataclassTokenState(self.rai_reserve + x.rai_reserve,
+                                   self.eth_reserve + x.eth_reserve,
+                                   self.rai_debt + x.rai_debt,
+                                   self.eth_locked + x.eth_locked)
+
+    def __mul__(self, x):
+        return DataclassTokenState(self.rai_reserve * x,
+                                   self.eth_reserve * x,
+                                   self.rai_debt * x,
+                                   self.eth_locked * x)
+
+
+@dataclass(frozen=True)
+class DataclassControllerState():
+    redemption_price: float
+    redemption_rate: float
+    proportional_error: float
+    integral_error: float
+
+
+@dataclass(frozen=True)
+class DataclassControllerParams():
+    kp: float
+    ki: float
+    leaky_factor: float
+    period: int
+    enabled: bool
+
+
+def operations(token_type, state_type, params_type) -> dict[str, Callable]:
+    token_state = token_type(1.0, 2.0, 3.0, 4.0)
+    model_state = {'token_state': token_state,
+                   'pid_state': state_type(1.0, 0.0, 0.0, 0.0),
+                   'pid_params': params_type(1e-7, 1e-9, 1.0, 3600, True)}
+    return {'construct': lambda: token_type(1.0, 2.0, 3.0, 4.0),
+            'add': lambda: token_state + token_state,
+            'mul': lambda: token_state * 0.5,
+            'deepcopy_state': lambda: deepcopy(model_state)}
+
+
+def measure_allocations(op: Callable, n: int) -> tuple[float, float]:
+    """
+    Number of memory blocks and bytes which are still allocated after
+    running `op`, per operation.
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [op() for _ in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del kept
+    return (blocks / n, size / n)
+
+
+def benchmark_state_types(n: int = 100_000,
+                          allocation_n: int = 10_000) -> pd.DataFrame:
+    implementations = {
+        'dataclass': (DataclassTokenState,
+                      DataclassControllerState,
+                      DataclassControllerParams),
+        'namedtuple': (TokenState, ControllerState, ControllerParams)
+    }
+    records = []
+    for (name, types) in implementations.items():
+        for (op_name, op) in operations(*types).items():
+            seconds = min(Timer(op).repeat(repeat=3, number=n)) / n
+            (blocks, size) = measure_allocations(op, allocation_n)
+            records.append({'implementation': name,
+                            'operation': op_name,
+                            'ns_per_op': seconds * 1e9,
+                            'blocks_per_op': blocks,
+                            'bytes_per_op': size})
+    return pd.DataFrame(records)
+
+
+@click.command()
+@click.option('-n', '--number', 'n',
+              default=100_000,
+              help="Number of operations to be timed")
+def main(n) -> None:
+    results = benchmark_state_types(n)
+    print(results.to_string(index=False, float_format='%.1f'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+VAR backend benchmark.
+
+Compares the per-call cost of the one-step `VAR_prediction` forecast on
+the statsmodels and NumPy backends, for different history lengths and
+lag orders, and the cost of forecasting a stack of runs at once with
+`VAR_prediction_batch` against a loop over the NumPy backend.
+"""
+from timeit import Timer
+import click
+import numpy as np
+import pandas as pd
+
+from rai_digital_twin.system_identification import VAR_BACKENDS, VAR_prediction, VAR_prediction_batch
+
+
+def benchmark_var(history_lengths: list[int],
+                  lags: list[int],
+                  n_variables: int = 4,
+                  number: int = 50) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    records = []
+    for n in history_lengths:
+        errors = rng.standard_normal((n, n_variables))
+        for lag in lags:
+            forecasts = {}
+            record = {'history_length': n, 'lag': lag}
+            for backend in VAR_BACKENDS:
+                forecasts[backend] = VAR_prediction(errors, lag, backend)
+                timer = Timer(lambda: VAR_prediction(errors, lag, backend))
+                seconds = min(timer.repeat(repeat=3, number=number)) / number
+                record[f'{backend}_ms'] = seconds * 1e3
+            record['speedup'] = record['statsmodels_ms'] / record['numpy_ms']
+            record['max_abs_diff'] = np.abs(forecasts['statsmodels']
+                                            - forecasts['numpy']).max()
+            records.append(record)
+    return pd.DataFrame(records)
+
+
+def benchmark_var_batch(history_length: int,
+                        lag: int,
+                        run_counts: list[int],
+                        n_variables: int = 4,
+                        number: int = 20) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    records = []
+    for n_runs in run_counts:
+        errors = rng.standard_normal((n_runs, history_length, n_variables))
+        record = {'runs': n_runs, 'history_length': history_length, 'lag': lag}
+        timers = {'loop': Timer(lambda: [VAR_prediction(series, lag, 'numpy')
+                                         for series in errors]),
+                  'batch': Timer(lambda: VAR_prediction_batch(errors, lag))}
+        for (name, timer) in timers.items():
+            seconds = min(timer.repeat(repeat=3, number=number)) / number
+            record[f'{name}_ms'] = seconds * 1e3
+        record['speedup'] = record['loop_ms'] / record['batch_ms']
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+@click.command()
+@click.option('-n', '--lengths', 'lengths',
+              default='200,1000,5000',
+              help="Comma-separated error history lengths")
+@click.option('-l', '--lags', 'lags',
+              default='1,5,15',
+              help="Comma-separated lag orders")
+@click.option('-r', '--runs', 'runs',
+              default='10,50,200',
+              help="Comma-separated amounts of runs for the batched fit")
+def main(lengths, lags, runs) -> None:
+    lengths = [int(el) for el in lengths.split(',')]
+    lags = [int(el) for el in lags.split(',')]
+    results = benchmark_var(lengths, lags)
+    print(results.to_string(index=False))
+    batch_results = benchmark_var_batch(lengths[0],
+                                        lags[-1],
+                                        [int(el) for el in runs.split(',')])
+    print(batch_results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+data_cache.py
+
+Persistent local store for the historical data retrieved from the RAI
+subgraph. Every table is keyed by block number, so that consecutive
+retrievals only need to request the heights that are not stored yet.
+"""
+from dataclasses import dataclass
+from json import dump, load
+from pathlib import Path
+import os
+import pandas as pd
+from pandas import DataFrame
+
+HOURLY_STATS_FILE = 'hourly_stats.csv.gz'
+SYSTEM_STATES_FILE = 'system_states.csv.gz'
+SAFE_HISTORY_FILE = 'safe_history.csv.gz'
+COVERAGE_FILE = 'coverage.json'
+
+# Append-only files with the block heights retrieved since the last save
+SYSTEM_STATES_CHECKPOINT_FILE = 'system_states.checkpoint.csv'
+SAFE_HISTORY_CHECKPOINT_FILE = 'safe_history.checkpoint.csv'
+# Last column on every checkpointed row, which is only there if the
+# row was fully written
+CHECKPOINT_SENTINEL = 'checkpoint_complete'
+
+# Half-open [start, end) interval of unix timestamps
+Interval = tuple[int, int]
+
+
+@dataclass
+class BlockCache():
+    path: Path
+    hourly_stats: DataFrame
+    system_states: DataFrame
+    safe_history: DataFrame
+    # Timestamp intervals on which the hourly stats are known to be complete
+    hourly_stats_coverage: list[Interval]
+
+
+def empty_block_frame() -> DataFrame:
+    df = pd.DataFrame()
+    df.index.name = 'block_number'
+    return df
+
+
+def read_block_frame(path: Path) -> DataFrame:
+    if path.exists():
+        df = pd.read_csv(path, index_col='block_number')
+        if 'timestamp' in df.columns:
+            df['timestamp'] = pd.to_datetime(df.timestamp)
+        return df
+    else:
+        return empty_block_frame()
+
+
+def read_checkpoint(path: Path) -> DataFrame:
+    """
+    Read a checkpoint file while dropping any row which was only partially
+    written when the retrieval was interrupted.
+    """
+    if path.exists():
+        df = pd.read_csv(path, index_col='block_number', on_bad_lines='skip')
+        if CHECKPOINT_SENTINEL in df.columns:
+            # Null values from the subgraph are kept
+            df = df[df[CHECKPOINT_SENTINEL] == 1].drop(columns=CHECKPOINT_SENTINEL)
+        return df
+    else:
+        return empty_block_frame()
+
+
+def write_block_frame(df: DataFrame, path: Path) -> None:
+    """
+    Write a block-indexed table by replacing the previous file atomically.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    df.to_csv(tmp_path, compression='gzip')
+    os.replace(tmp_path, path)
+
+
+def load_block_cache(path: str) -> BlockCache:
+    """
+    Load the local store at `path`, or an empty one if there's none.
+    """
+    cache_path = Path(path).expanduser()
+    hourly_stats = read_block_frame(cache_path / HOURLY_STATS_FILE)
+    system_states = read_block_frame(cache_path / SYSTEM_STATES_FILE)
+    safe_history = read_block_frame(cache_path / SAFE_HISTORY_FILE)
+
+    # Resume from the heights checkpointed by interrupted retrievals
+    system_states = upsert_blocks(system_states,
+                                  read_checkpoint(cache_path / SYSTEM_STATES_CHECKPOINT_FILE))
+    safe_history = upsert_blocks(safe_history,
+                                 read_checkpoint(cache_path / SAFE_HISTORY_CHECKPOINT_FILE))
+
+    coverage_path = cache_path / COVERAGE_FILE
+    if coverage_path.exists():
+        with open(coverage_path, 'r') as fid:
+            coverage = [tuple(interval) for interval in load(fid)]
+    else:
+        coverage = []
+
+    return BlockCache(cache_path,
+                      hourly_stats,
+                      system_states,
+                      safe_history,
+                      coverage)
+
+
+def save_block_cache(cache: BlockCache) -> None:
+    cache.path.mkdir(parents=True, exist_ok=True)
+    write_block_frame(cache.hourly_stats, cache.path / HOURLY_STATS_FILE)
+    write_block_frame(cache.system_states, cache.path / SYSTEM_STATES_FILE)
+    write_block_frame(cache.safe_history, cache.path / SAFE_HISTORY_FILE)
+
+    tmp_path = cache.path / (COVERAGE_FILE + '.tmp')
+    with open(tmp_path, 'w') as fid:
+        dump(cache.hourly_stats_coverage, fid)
+    os.replace(tmp_path, cache.path / COVERAGE_FILE)
+
+    # Checkpointed heights are now part of the consolidated tables
+    for checkpoint in (SYSTEM_STATES_CHECKPOINT_FILE,
+                       SAFE_HISTORY_CHECKPOINT_FILE):
+        (cache.path / checkpoint).unlink(missing_ok=True)
+
+
+def truncate_partial_row(path: Path, chunk_size: int = 4096) -> None:
+    """
+    Cut a partially written last row off a checkpoint file, so that the
+    next append doesn't glue a new row onto it.
+    """
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - chunk_size, 0)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+def append_block_checkpoint(cache: BlockCache,
+                            system_states: DataFrame,
+                            safe_history: DataFrame) -> None:
+    """
+    Append freshly retrieved block heights to the checkpoint files, so
+    that they aren't lost if the retrieval is interrupted before the
+    cache is saved.
+    """
+    cache.path.mkdir(parents=True, exist_ok=True)
+    for (df, name) in ((system_states, SYSTEM_STATES_CHECKPOINT_FILE),
+                       (safe_history, SAFE_HISTORY_CHECKPOINT_FILE)):
+        path = cache.path / name
+        if path.exists():
+            truncate_partial_row(path)
+        has_header = path.exists() and path.stat().st_size > 0
+        (df.assign(**{CHECKPOINT_SENTINEL: 1})
+           .to_csv(path, mode='a', header=not has_header))
+
+
+def upsert_blocks(cached: DataFrame, new: DataFrame) -> DataFrame:
+    """
+    Merge two block-indexed tables. Rows on `new` take precedence.
+    """
+    if len(cached) == 0:
+        merged = new
+    elif len(new) == 0:
+        merged = cached
+    else:
+        merged = pd.concat([cached[~cached.index.isin(new.index)], new])
+    merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+    merged.index.name = 'block_number'
+    return merged
+
+
+def merge_intervals(intervals: list[Interval]) -> list[Interval]:
+    """
+    Merge overlapping or adjacent intervals.
+    """
+    merged: list[Interval] = []
+    for (start, end) in sorted(intervals):
+        if end <= start:
+            continue
+        elif len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_intervals(coverage: list[Interval],
+                      interval: Interval) -> list[Interval]:
+    """
+    Return the parts of `interval` which are not on `coverage`.
+    """
+    (start, end) = interval
+    missing = []
+    cursor = start
+    for (covered_start, covered_end) in merge_intervals(coverage):
+        if covered_end <= cursor:
+            continue
+        elif covered_start >= end:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
@@ -1,54 +1,64 @@
 from rai_digital_twin.models.digital_twin_v1.model.params import NUMERICAL_PARAMS
 from time import time
-from typing import Any
+from typing import Any, Union
 from pandas.core.frame import DataFrame
-import pandas as pd
 from datetime import datetime, timedelta
-from os import listdir
 from pathlib import Path
 from cadCAD_tools import easy_run
 from cadCAD_tools.preparation import prepare_params, Param, ParamSweep
 from json import dump
+from tempfile import TemporaryDirectory
 import papermill as pm
 import os
 
 # Module dependencies
-from .retrieve_data import download_data
-from .prepare_data import load_backtesting_data, load_governance_events
+from .artifacts import ARTIFACT_SUFFIXES, DEFAULT_ARTIFACT_FORMAT
+from .artifacts import artifact_path, find_last_artifact, write_artifact
+from .retrieve_data import DEFAULT_MAX_WORKERS, download_data
+from .prepare_data import load_array_backtesting_data, load_governance_events
+from .prepare_data import timestep_frame
+from .timeline import TimelineIndex
 from .backtesting import simulation_loss
-from .stochastic import FitParams, fit_eth_price, generate_eth_samples
+from .system_identification import ActionErrorPrefix
+from .stochastic import DEFAULT_FIT_METHOD, FitParams, generate_eth_samples, timed_fit_eth_price
 from rai_digital_twin import default_model
-from rai_digital_twin.types import ActionState, BacktestingData, ControllerParams, ControllerState, Days, ExogenousData, Percentage
+from rai_digital_twin.models.digital_twin_v1.model.parts.token_state import clear_run_buffers
+from rai_digital_twin.types import ActionState, ArrayBacktestingData, BacktestingData, ControllerParams, ControllerState, Days, ExogenousData, Percentage
 from rai_digital_twin.types import GovernanceEvent, Timestep, USD_per_ETH
 
 
 def retrieve_data(output_path: str,
-                  date_range: tuple[Any, Any]) -> DataFrame:
+                  date_range: tuple[Any, Any],
+                  max_workers: int = DEFAULT_MAX_WORKERS,
+                  cache_path: str = None) -> DataFrame:
     """
     Download all requried data
     """
-    df = download_data(date_range=date_range)
-    df.to_csv(output_path, compression='gzip')
+    df = download_data(date_range=date_range,
+                       max_workers=max_workers,
+                       cache_path=cache_path)
+    write_artifact(df, output_path, index=True)
     return df
 
 
 def prepare(input_path: str,
-            governance_input_path) -> tuple[BacktestingData,
+            governance_input_path) -> tuple[ArrayBacktestingData,
                                             dict[Timestep, GovernanceEvent]]:
     """
     Clean-up required historical and prior data.
     """
-    backtesting_data = load_backtesting_data(input_path)
+    backtesting_data = load_array_backtesting_data(input_path)
 
+    timeline = TimelineIndex.from_backtesting_data(backtesting_data)
     governance_events = load_governance_events(governance_input_path,
-                                               backtesting_data.heights)
+                                               timeline)
 
     # TODO run notebook template
 
     return (backtesting_data, governance_events)
 
 
-def backtest_model(backtesting_data: BacktestingData,
+def backtest_model(backtesting_data: Union[BacktestingData, ArrayBacktestingData],
                    governance_events) -> tuple[DataFrame, DataFrame, DataFrame]:
     """
     Perform historical backtesting by using the past controller state
@@ -91,21 +101,24 @@ def backtest_model(backtesting_data: BacktestingData,
                           assign_params=False)
 
     sim_df = default_model.post_processing(raw_sim_df)
-    test_df = pd.DataFrame.from_dict(
-        backtesting_data.pid_states, orient='index')
+    test_df = timestep_frame(backtesting_data.pid_states)
     loss = simulation_loss(sim_df, test_df)
     print(f"Backtesting loss: {loss :.2%}")
 
     return (sim_df, test_df, raw_sim_df)
 
 
-def stochastic_fit(input_data: object) -> FitParams:
+def stochastic_fit(input_data: object,
+                   method: str = DEFAULT_FIT_METHOD) -> FitParams:
     """
     Acquire parameters for the stochastic input signals.
     """
 
-    X = pd.DataFrame(input_data).T.eth_price
-    params = fit_eth_price(X)
+    X = timestep_frame(input_data).eth_price
+    result = timed_fit_eth_price(X, method)
+    params = result.params
+    print(f"ETH price fit ({method}): shape={params.shape :.4g}, "
+          f"scale={params.scale :.4g} in {result.wall_seconds :.3f}s")
     return params
 
 
@@ -154,10 +167,10 @@ def extrapolate_data(signals: object,
     initial_pid_params = last_row['pid_params']
 
     # Append all past action states for usage on the fit-predict process
-    cols = {'token_state',
+    cols = ['token_state',
             'pid_state',
             'market_price',
-            'eth_price'}
+            'eth_price']
     # TODO use pid_state from test_df rather than sim_df
     records = (raw_sim_df.reset_index()
                .loc[:, cols]
@@ -175,7 +188,6 @@ def extrapolate_data(signals: object,
     params.update(backtesting_action_states=Param(past_action_states, None))
     params.update(use_ewm_model=ParamSweep([False, True], Percentage))
     params.update(convergence_swap_intensity=ParamSweep([None, 0.25], Percentage))
-    prepared_params = prepare_params(params, cartesian_sweep=True)
 
     # Update initial state for extrapolation
     initial_state.update(pid_state=initial_pid_state,
@@ -185,14 +197,34 @@ def extrapolate_data(signals: object,
                          spot_price=last_row.spot_price,
                          market_price=last_row.market_price)  # TODO use test df state
 
-    # Run extrapolation simulation
-    sim_df = easy_run(initial_state,
-                      prepared_params,
-                      default_model.timestep_block,
-                      N_t,
-                      N_samples,
-                      drop_substeps=True,
-                      assign_params=NUMERICAL_PARAMS)
+    with TemporaryDirectory() as tmp_path:
+        # Compute the backtesting action errors once for all runs.
+        # They're memory-mapped, so that parallel workers share the file
+        # rather than receiving a pickled copy each. The file only lives
+        # during this run, so the prefix is kept off the model parameters
+        run_params = dict(params)
+        user_action_params = params['user_action_params']
+        ewm_alpha = params['ewm_alpha']
+        if type(user_action_params) == Param and type(ewm_alpha) == Param:
+            prefix = ActionErrorPrefix.from_states(past_action_states,
+                                                   user_action_params.value,
+                                                   ewm_alpha.value,
+                                                   str(Path(tmp_path) / 'backtesting_errors.npy'))
+            run_params.update(backtesting_error_prefix=Param(prefix, None))
+        prepared_params = prepare_params(run_params, cartesian_sweep=True)
+
+        try:
+            # Run extrapolation simulation
+            sim_df = easy_run(initial_state,
+                              prepared_params,
+                              default_model.timestep_block,
+                              N_t,
+                              N_samples,
+                              drop_substeps=True,
+                              assign_params=NUMERICAL_PARAMS)
+        finally:
+            # Buffers may continue the prefix which is about to be deleted
+            clear_run_buffers()
 
     # Clean-up
     sim_df = default_model.post_processing(sim_df)
@@ -207,7 +239,11 @@ def extrapolation_cycle(base_path: str = None,
                         extrapolation_samples: int = 1,
                         extrapolation_timesteps: int = 7 * 24,
                         use_last_data=False,
-                        generate_reports=True) -> object:
+                        generate_reports=True,
+                        max_workers: int = DEFAULT_MAX_WORKERS,
+                        use_cache=True,
+                        artifact_format: str = DEFAULT_ARTIFACT_FORMAT,
+                        fit_method: str = DEFAULT_FIT_METHOD) -> object:
     """
     Perform a entire extrapolation cycle.
     """
@@ -223,21 +259,23 @@ def extrapolation_cycle(base_path: str = None,
         data_path = working_path / 'data/runs'
 
     governance_data_path = working_path / 'data/controller_params.csv'
+    cache_path = working_path / 'data/cache' if use_cache else None
     
     if use_last_data is False:
         date_end = runtime - timedelta(days=historical_lag)
         date_start = date_end - timedelta(days=historical_interval)
         date_range = (date_start, date_end)
 
-        historical_data_path = data_path / f'{runtime}_retrieval.csv.gz'
+        historical_data_path = artifact_path(data_path,
+                                             f'{runtime}_retrieval',
+                                             artifact_format)
         retrieve_data(str(historical_data_path),
-                      date_range)
+                      date_range,
+                      max_workers,
+                      cache_path)
         print(f"Data written at {historical_data_path}")
     else:
-        files = listdir(data_path.expanduser())
-        files = sorted(
-            file for file in files if 'retrieval.csv.gz' in file)
-        historical_data_path = data_path / f'{files[-1]}'
+        historical_data_path = find_last_artifact(data_path, 'retrieval')
         print(f"Using last data at {historical_data_path}")
 
     print("1. Preparing Data\n---")
@@ -248,13 +286,11 @@ def extrapolation_cycle(base_path: str = None,
     print("2. Backtesting Model\n---")
     backtest_results = backtest_model(backtesting_data, governance_events)
 
-    backtest_results[0].to_csv(data_path / f'{runtime}-backtesting.csv.gz',
-                               compression='gzip',
-                               index=False)
+    write_artifact(backtest_results[0],
+                   artifact_path(data_path, f'{runtime}-backtesting', artifact_format))
 
-    backtest_results[1].to_csv(data_path / f'{runtime}-historical.csv.gz',
-                               compression='gzip',
-                               index=False)
+    write_artifact(backtest_results[1],
+                   artifact_path(data_path, f'{runtime}-historical', artifact_format))
 
     timestamps = sorted([el['timestamp']
                          for (timestep, el)
@@ -268,7 +304,8 @@ def extrapolation_cycle(base_path: str = None,
         dump(metadata, fid)
 
     print("3. Fitting Stochastic Processes\n---")
-    stochastic_params = stochastic_fit(backtesting_data.exogenous_data)
+    stochastic_params = stochastic_fit(backtesting_data.exogenous_data,
+                                       fit_method)
 
     print("4. Extrapolating Exogenous Signals\n---")
     N_t = extrapolation_timesteps
@@ -287,9 +324,8 @@ def extrapolation_cycle(base_path: str = None,
                                         N_t,
                                         N_extrapolation_samples)
 
-    extrapolation_df.to_csv(data_path / f'{runtime}-extrapolation.csv.gz',
-                            compression='gzip',
-                            index=False)
+    write_artifact(extrapolation_df,
+                   artifact_path(data_path, f'{runtime}-extrapolation', artifact_format))
 
     print("6. Exporting results\n---")
     if generate_reports == True:
@@ -303,7 +339,8 @@ def extrapolation_cycle(base_path: str = None,
         pm.execute_notebook(
             input_nb_path,
             output_nb_path,
-            parameters=dict(base_path=path)
+            parameters=dict(base_path=path,
+                            artifact_suffix=ARTIFACT_SUFFIXES[artifact_format])
         )
         export_cmd = f"jupyter nbconvert --to html '{output_nb_path}'"
         os.system(export_cmd)
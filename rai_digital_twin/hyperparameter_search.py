@@ -0,0 +1,177 @@
+"""
+hyperparameter_search.py
+
+Rolling-origin cross-validation of the `ewm_alpha` and `var_lag` params of
+the user action model over the historical action states.
+
+For every origin t, the model is fitted on the states before t and its
+one-step-ahead action is compared against the real change of the token
+state at t. The errors for each `ewm_alpha` are computed once over the
+whole history, since every fold only uses a prefix of them, and the power
+transformer of each fold is shared by all the lags. Folds are split into
+chunks which are evaluated on a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import click
+import numpy as np
+import pandas as pd
+
+from rai_digital_twin.artifacts import find_last_artifact
+from rai_digital_twin.prepare_data import historical_action_states, load_array_backtesting_data
+from rai_digital_twin.system_identification import PowerTransformerCache, action_error_array, predict_action
+from rai_digital_twin.types import ActionState, TokenState, UserActionParams
+from rai_digital_twin.models.digital_twin_v1.model.params import USER_ACTION_PARAMS
+
+DEFAULT_ALPHAS = (0.5, 0.8, 0.95)
+DEFAULT_LAGS = (1, 3, 5, 10, 15)
+
+
+def validate_folds(errors: np.ndarray,
+                   states: dict[int, ActionState],
+                   origins: list[int],
+                   lags: list[int],
+                   action_params: UserActionParams) -> list[dict]:
+    """
+    One-step-ahead predicted actions at each origin for every lag.
+    `errors` are the errors over all the action states, of which the first
+    `origin - 1` are the ones over the states before `origin`, and
+    `states` holds the last state before each origin.
+    """
+    records = []
+    for origin in origins:
+        fold_errors = errors[:origin - 1]
+        state = states[origin - 1]
+        # The transformer is fitted on the first lag and reused by the others
+        transformer_cache = PowerTransformerCache()
+        for lag in lags:
+            start = perf_counter()
+            action = predict_action(fold_errors,
+                                    state,
+                                    action_params,
+                                    lag,
+                                    'numpy',
+                                    transformer_cache)
+            records.append({'origin': origin,
+                            'var_lag': lag,
+                            'action': action,
+                            'fit_seconds': perf_counter() - start})
+    return records
+
+
+def rolling_origin_search(states: list[ActionState],
+                          alphas: list[float] = DEFAULT_ALPHAS,
+                          lags: list[int] = DEFAULT_LAGS,
+                          action_params: UserActionParams = USER_ACTION_PARAMS,
+                          min_history: int = 100,
+                          step: int = 1,
+                          max_workers: int = None,
+                          chunk_size: int = 20) -> pd.DataFrame:
+    """
+    Rank every (ewm_alpha, var_lag) candidate by its one-step-ahead
+    forecast error over the origins on [min_history, len(states)).
+
+    The error of each token state field is scaled by the standard
+    deviation of its real changes, and the `score` is the mean of the
+    scaled RMSEs. The `fit_seconds` column is the total time spent on
+    fitting and predicting for each candidate, on which the first lag
+    also includes fitting the shared power transformers.
+    """
+    origins = list(range(min_history, len(states), step))
+    if len(origins) == 0:
+        raise ValueError(f"{len(states)} states aren't enough for "
+                         f"{min_history} states of history")
+    chunks = [origins[i:i + chunk_size]
+              for i in range(0, len(origins), chunk_size)]
+
+    token_states = np.array([state.token_state for state in states],
+                            dtype=float)
+    real_changes = np.diff(token_states, axis=0)[np.array(origins) - 1]
+    scales = real_changes.std(axis=0)
+    scales[scales == 0] = 1.0
+
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for alpha in alphas:
+            errors = action_error_array(states, action_params, alpha)
+            for chunk in chunks:
+                chunk_states = {origin - 1: states[origin - 1]
+                                for origin in chunk}
+                future = executor.submit(validate_folds,
+                                         errors[:chunk[-1] - 1],
+                                         chunk_states,
+                                         chunk,
+                                         lags,
+                                         action_params)
+                futures[future] = alpha
+
+        records = []
+        for (future, alpha) in futures.items():
+            for record in future.result():
+                records.append(dict(record, ewm_alpha=alpha))
+    wall_seconds = perf_counter() - start
+
+    df = pd.DataFrame(records)
+    predicted_changes = np.array(df.action.tolist(), dtype=float)
+    scaled_errors = (predicted_changes
+                     - np.diff(token_states, axis=0)[df.origin - 1]) / scales
+    for (i, field) in enumerate(TokenState._fields):
+        df[f'{field}_squared_error'] = scaled_errors[:, i] ** 2
+
+    aggregations = {f'{field}_rmse': (f'{field}_squared_error', 'mean')
+                    for field in TokenState._fields}
+    results = (df.groupby(['ewm_alpha', 'var_lag'])
+                 .agg(**aggregations,
+                      n_folds=('origin', 'count'),
+                      fit_seconds=('fit_seconds', 'sum'))
+                 .reset_index())
+    rmse_columns = list(aggregations.keys())
+    results[rmse_columns] = np.sqrt(results[rmse_columns])
+    results['score'] = results[rmse_columns].mean(axis=1)
+    results.attrs['wall_seconds'] = wall_seconds
+    return (results.sort_values('score')
+                   .reset_index(drop=True))
+
+
+@click.command()
+@click.option('-i', '--input', 'input_path',
+              default=None,
+              help="Retrieval file with the historical data. Defaults to the last one at data/runs")
+@click.option('-a', '--alphas', 'alphas',
+              default=','.join(str(el) for el in DEFAULT_ALPHAS),
+              help="Comma-separated ewm_alpha candidates")
+@click.option('-l', '--lags', 'lags',
+              default=','.join(str(el) for el in DEFAULT_LAGS),
+              help="Comma-separated var_lag candidates")
+@click.option('-m', '--min-history', 'min_history',
+              default=100,
+              help="Number of action states before the first origin")
+@click.option('-s', '--step', 'step',
+              default=1,
+              help="Number of timesteps between origins")
+@click.option('-w', '--max-workers', 'max_workers',
+              default=None,
+              type=int,
+              help="Number of worker processes. Defaults to the number of CPUs")
+@click.option('-o', '--output', 'output_path',
+              default=None,
+              help="Path for writing the ranked table as CSV")
+def main(input_path, alphas, lags, min_history, step, max_workers, output_path) -> None:
+    if input_path is None:
+        input_path = find_last_artifact('data/runs', 'retrieval')
+    states = historical_action_states(load_array_backtesting_data(str(input_path)))
+    results = rolling_origin_search(states,
+                                    [float(el) for el in alphas.split(',')],
+                                    [int(el) for el in lags.split(',')],
+                                    min_history=min_history,
+                                    step=step,
+                                    max_workers=max_workers)
+    print(results.to_string(index=False))
+    print(f"Total wall time: {results.attrs['wall_seconds'] :.2f}s")
+    if output_path is not None:
+        results.to_csv(output_path, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+ingestion.py
+
+Schema-driven parsing of subgraph JSON records into typed NumPy columns.
+
+Every column is described by the path of keys leading to its value on a
+record. Columns are extracted through chained `operator.itemgetter` maps
+and converted by `np.fromiter`, so that no Python-level function is called
+per cell, and written into preallocated arrays as the pages arrive.
+"""
+from dataclasses import dataclass
+from functools import reduce
+from operator import itemgetter
+from typing import Iterable
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class ColumnSpec():
+    name: str
+    path: tuple[str, ...]
+    dtype: type = np.float64
+
+
+HOURLY_STATS_SCHEMA = (
+    ColumnSpec('timestamp', ('timestamp',), np.int64),
+    ColumnSpec('blockNumber', ('blockNumber',), np.int64),
+    ColumnSpec('marketPriceUsd', ('marketPriceUsd',)),
+    ColumnSpec('marketPriceEth', ('marketPriceEth',))
+)
+
+SYSTEM_STATE_SCHEMA = (
+    ColumnSpec('debtAvailableToSettle', ('debtAvailableToSettle',)),
+    ColumnSpec('globalDebt', ('globalDebt',)),
+    ColumnSpec('globalDebtCeiling', ('globalDebtCeiling',)),
+    ColumnSpec('systemSurplus', ('systemSurplus',)),
+    ColumnSpec('totalActiveSafeCount', ('totalActiveSafeCount',), np.int64),
+    ColumnSpec('RedemptionRateAnnualizedRate',
+               ('currentRedemptionRate', 'annualizedRate')),
+    ColumnSpec('RedemptionRateHourlyRate',
+               ('currentRedemptionRate', 'hourlyRate')),
+    ColumnSpec('RedemptionRateEightHourlyRate',
+               ('currentRedemptionRate', 'eightHourlyRate')),
+    ColumnSpec('RedemptionPrice', ('currentRedemptionPrice', 'value')),
+    ColumnSpec('EthInUniswap', ('coinUniswapPair', 'reserve1')),
+    ColumnSpec('RaiInUniswap', ('coinUniswapPair', 'reserve0')),
+    ColumnSpec('RaiDrawnFromSAFEs', ('erc20CoinTotalSupply',))
+)
+
+
+def nest_schema(schema: tuple[ColumnSpec, ...],
+                prefix: tuple[str, ...]) -> tuple[ColumnSpec, ...]:
+    """
+    Schema for records which hold the original ones under `prefix`.
+    """
+    return tuple(ColumnSpec(spec.name, prefix + spec.path, spec.dtype)
+                 for spec in schema)
+
+
+# Records as returned by `retrieve_data.query_blocks`
+BLOCK_STATE_SCHEMA = ((ColumnSpec('block_number', ('block_number',), np.int64),)
+                      + nest_schema(SYSTEM_STATE_SCHEMA, ('system_state',)))
+
+
+def extract_column(records: list[dict],
+                   spec: ColumnSpec) -> np.ndarray:
+    """
+    Extract a typed column out of a list of (nested) records.
+    """
+    values = reduce(lambda it, key: map(itemgetter(key), it),
+                    spec.path,
+                    iter(records))
+    try:
+        return np.fromiter(values, dtype=spec.dtype, count=len(records))
+    except (TypeError, ValueError):
+        # Null or non-numeric values are parsed as NaN
+        values = reduce(lambda it, key: map(itemgetter(key), it),
+                        spec.path,
+                        iter(records))
+        column = pd.to_numeric(pd.Series(list(values), dtype=object),
+                               errors='coerce')
+        return column.to_numpy(dtype=np.float64)
+
+
+class ColumnBuffer():
+    """
+    Preallocated typed columns which are filled page by page.
+    The capacity grows geometrically if more rows than expected arrive.
+    """
+
+    def __init__(self,
+                 schema: tuple[ColumnSpec, ...],
+                 capacity: int = 1024):
+        self.schema = schema
+        self.size = 0
+        self.columns = {spec.name: np.empty(capacity, dtype=spec.dtype)
+                        for spec in schema}
+
+    @property
+    def capacity(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+    def reserve(self, capacity: int) -> None:
+        if capacity > self.capacity:
+            for (name, column) in self.columns.items():
+                new_column = np.empty(capacity, dtype=column.dtype)
+                new_column[:self.size] = column[:self.size]
+                self.columns[name] = new_column
+
+    def append_page(self, records: list[dict]) -> None:
+        n = len(records)
+        if self.size + n > self.capacity:
+            self.reserve(max(self.size + n, 2 * self.capacity))
+
+        for spec in self.schema:
+            column = extract_column(records, spec)
+            dtype = np.result_type(self.columns[spec.name], column)
+            if dtype != self.columns[spec.name].dtype:
+                # Promote integer columns if there were nulls, but never
+                # demote them back on the following pages
+                self.columns[spec.name] = self.columns[spec.name].astype(dtype)
+            self.columns[spec.name][self.size:self.size + n] = column
+        self.size += n
+
+    def to_dict(self) -> dict[str, np.ndarray]:
+        return {name: column[:self.size]
+                for (name, column) in self.columns.items()}
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.to_dict())
+
+
+def ingest_pages(pages: Iterable[list[dict]],
+                 schema: tuple[ColumnSpec, ...],
+                 capacity: int = 1024) -> pd.DataFrame:
+    """
+    Parse pages of records into a DataFrame with typed columns.
+    """
+    buffer = ColumnBuffer(schema, capacity)
+    for page in pages:
+        buffer.append_page(page)
+    return buffer.to_frame()
@@ -1,5 +1,6 @@
 from typing import Union
 from cadCAD_tools.types import Param, ParamSweep
+from rai_digital_twin.system_identification import ActionErrorPrefix
 from rai_digital_twin.types import ActionState, GovernanceEvent, Height, PIBoundParams, Percentage, Seconds, Timestep, TimestepDict, UserActionParams
 
 
@@ -20,6 +21,12 @@ PI_BOUND_PARAMS = PIBoundParams(
 
 NUMERICAL_PARAMS = {'ewm_alpha',
                     'var_lag',
+                    'var_estimator',
+                    'var_forgetting_factor',
+                    'var_lag_criterion',
+                    'power_refit_interval',
+                    'power_refit_drift',
+                    'history_window',
                     'convergence_swap_intensity',
                     'extrapolation_timedelta',
                     'use_ewm_model',
@@ -39,10 +46,25 @@ params: dict[str, Union[Param, ParamSweep]] = {
 
     # Extrapolation specific parameters
     'backtesting_action_states': Param(None, tuple[ActionState]),
+    # Action errors over `backtesting_action_states`, shared by all runs
+    'backtesting_error_prefix': Param(None, ActionErrorPrefix),
     'user_action_params': Param(USER_ACTION_PARAMS, UserActionParams),
     'extrapolation_timedelta': Param(60 * 60, Seconds),
     'ewm_alpha': Param(0.8, float),
     'var_lag': Param(15, int),
+    # 'statsmodels' or 'numpy' for refitting the VAR on every timestep,
+    # or 'rls' for updating it through recursive least squares
+    'var_estimator': Param('statsmodels', str),
+    'var_forgetting_factor': Param(1.0, float),
+    # If 'aic', 'bic', 'hqic' or 'fpe', select the lag order up to `var_lag`
+    # which minimizes that information criterion
+    'var_lag_criterion': Param(None, str),
+    # Refit the power transformer every N timesteps, or earlier if the
+    # transformed errors drift from standard normal by more than this
+    'power_refit_interval': Param(1, int),
+    'power_refit_drift': Param(None, float),
+    # Fit the action model only on the errors of the last N steps
+    'history_window': Param(None, int),
     'convergence_swap_intensity': Param(None, Percentage),
     'use_ewm_model': Param(True, bool),
 
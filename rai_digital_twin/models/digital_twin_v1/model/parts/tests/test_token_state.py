@@ -0,0 +1,368 @@
+import pickle
+from typing import Callable
+import numpy as np
+from pytest import approx
+from sklearn.preprocessing import PowerTransformer
+
+from rai_digital_twin.models.digital_twin_v1.model.parts.token_state import *
+from rai_digital_twin.system_identification import ActionErrorPrefix, OnlineVAR, action_error_array, transformed_prediction_to_action
+from rai_digital_twin.types import UserActionParams
+
+
+def random_state(rng, run=1) -> dict:
+    return {'token_state': TokenState(*(rng.random(4) * 10 + 1)),
+            'pid_state': ControllerState(*(rng.random(4) + 0.5)),
+            'market_price': rng.random() + 0.5,
+            'eth_price': rng.random() + 1.0,
+            'simulation': 0,
+            'subset': 0,
+            'run': run}
+
+
+def test_action_error_buffer():
+    """
+    Make sure that the incremental errors are the same as recomputing them
+    from the full action state history on every timestep.
+    """
+    rng = np.random.default_rng(0)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(30)]
+    params = {'backtesting_action_states': past_states,
+              'user_action_params': UserActionParams(1.5, 1e6, 0.003, True, 1.0),
+              'ewm_alpha': 0.8,
+              'history_window': None}
+
+    for run in (1, 2):
+        history = []
+        for _ in range(10):
+            state = random_state(rng, run)
+            buffer = action_error_buffer(params, history, state)
+            expected = action_error_array(prepare_action_state_history(params, history, state),
+                                          params['user_action_params'],
+                                          params['ewm_alpha'])
+            assert buffer.errors == approx(expected)
+
+            # The user action changes the state before it goes into history
+            final_state = dict(state, token_state=state['token_state'] * 1.01)
+            history.append([state, final_state])
+
+
+def test_online_action_predictor():
+    """
+    Make sure that the online predictor is equivalent to refitting the VAR
+    on all errors with the power transformer of its last refit.
+    """
+    rng = np.random.default_rng(1)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(40)]
+    params = {'backtesting_action_states': past_states,
+              'user_action_params': UserActionParams(1.5, 1e6, 0.003, True, 1.0),
+              'ewm_alpha': 0.8,
+              'var_lag': 2,
+              'var_forgetting_factor': 1.0,
+              'history_window': None}
+
+    history = []
+    for _ in range(5):
+        state = random_state(rng)
+        buffer = action_error_buffer(params, history, state)
+        predictor = run_model('online_predictor',
+                              (params['var_lag'], params['var_forgetting_factor']),
+                              OnlineActionPredictor,
+                              state,
+                              buffer)
+        action = predictor.predict(buffer.errors,
+                                   len(buffer.errors) - 1,
+                                   state_to_action_state(state),
+                                   params['user_action_params'])
+
+        transformed_errors = predictor.transformer.transform(buffer.errors)
+        forecast = OnlineVAR(2).fit(transformed_errors).forecast()
+        expected = transformed_prediction_to_action(forecast,
+                                                    predictor.transformer,
+                                                    state_to_action_state(state),
+                                                    params['user_action_params'])
+        assert action == approx(expected)
+
+        history.append([state, dict(state, token_state=state['token_state'] * 1.01)])
+
+
+def test_online_predictor_refits():
+    """
+    Make sure that the online predictor refits its power transformer with
+    the `PowerTransformerCache` policy, and fits its VAR model again on
+    every refit.
+    """
+    rng = np.random.default_rng(3)
+    states = [state_to_action_state(random_state(rng)) for _ in range(40)]
+    action_params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    errors = rng.normal(size=(40, 4))
+    predictor = OnlineActionPredictor(2, 1.0, refit_interval=3)
+
+    refits = []
+    for n_committed in range(20, 30):
+        action = predictor.predict(errors[:n_committed + 1],
+                                   n_committed,
+                                   states[n_committed],
+                                   action_params)
+        refits.append(predictor.transformer_cache.n_fitted)
+
+        transformer = PowerTransformer().fit(errors[:refits[-1]])
+        var = OnlineVAR(2).fit(transformer.transform(errors[:n_committed + 1]))
+        expected = transformed_prediction_to_action(var.forecast(),
+                                                    transformer,
+                                                    states[n_committed],
+                                                    action_params)
+        assert action == approx(expected)
+    assert refits == [20, 20, 20, 23, 23, 23, 26, 26, 26, 29]
+
+
+def test_online_predictor_non_finite(monkeypatch):
+    """
+    Make sure that a non-finite forecast of the online predictor falls
+    back to no action.
+    """
+    rng = np.random.default_rng(4)
+    states = [state_to_action_state(random_state(rng)) for _ in range(30)]
+    action_params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    errors = action_error_array(states, action_params, 0.8)
+    monkeypatch.setattr(OnlineVAR, 'forecast',
+                        lambda self: np.full(4, np.nan))
+    action = OnlineActionPredictor(2).predict(errors,
+                                              len(errors),
+                                              states[-1],
+                                              action_params)
+    assert action == TokenState(0.0, 0.0, 0.0, 0.0)
+
+
+def test_windowed_action_error_buffer():
+    """
+    Make sure that a windowed buffer keeps the last errors on a fixed
+    amount of memory.
+    """
+    rng = np.random.default_rng(2)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(30)]
+    params = {'backtesting_action_states': past_states,
+              'user_action_params': UserActionParams(1.5, 1e6, 0.003, True, 1.0),
+              'ewm_alpha': 0.8,
+              'history_window': 12}
+
+    history = []
+    for _ in range(40):
+        state = random_state(rng, run=3)
+        buffer = action_error_buffer(params, history, state)
+        expected = action_error_array(prepare_action_state_history(params, history, state),
+                                      params['user_action_params'],
+                                      params['ewm_alpha'])
+        assert buffer.errors == approx(expected[-12:])
+        assert buffer.capacity == 14
+        history.append([state, dict(state, token_state=state['token_state'] * 1.01)])
+
+
+def test_shared_error_prefix(tmp_path):
+    """
+    Make sure that buffers continued from a memory-mapped prefix are the
+    same as the ones computed from the backtesting states.
+    """
+    rng = np.random.default_rng(3)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(30)]
+    user_action_params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    prefix = ActionErrorPrefix.from_states(past_states,
+                                           user_action_params,
+                                           0.8,
+                                           str(tmp_path / 'errors.npy'))
+
+    # Pickling only sends the path to the errors
+    unpickled_prefix = pickle.loads(pickle.dumps(prefix))
+    assert isinstance(unpickled_prefix.errors, np.memmap)
+    assert unpickled_prefix.errors == approx(prefix.errors)
+
+    for window in (None, 5, 40):
+        params = {'backtesting_action_states': past_states,
+                  'backtesting_error_prefix': unpickled_prefix,
+                  'user_action_params': user_action_params,
+                  'ewm_alpha': 0.8,
+                  'history_window': window}
+        history = []
+        for _ in range(15):
+            state = random_state(rng, run=4)
+            buffer = action_error_buffer(params, history, state)
+            assert buffer.shared_prefix is unpickled_prefix
+            expected = action_error_array(prepare_action_state_history(params, history, state),
+                                          user_action_params,
+                                          0.8)
+            assert buffer.errors == approx(expected[-(window or 0):])
+            history.append([state, dict(state, token_state=state['token_state'] * 1.01)])
+
+
+def extrapolation_params(past_states: list, **kwargs) -> dict:
+    params = {'perform_backtesting': False,
+              'use_ewm_model': True,
+              'convergence_swap_intensity': None,
+              'backtesting_action_states': past_states,
+              'backtesting_error_prefix': None,
+              'user_action_params': UserActionParams(1.5, 1e6, 0.003, True, 1.0),
+              'ewm_alpha': 0.8,
+              'var_lag': 2,
+              'var_estimator': 'numpy',
+              'var_forgetting_factor': 1.0,
+              'var_lag_criterion': None,
+              'power_refit_interval': 1,
+              'power_refit_drift': None,
+              'history_window': None}
+    params.update(kwargs)
+    return params
+
+
+def run_user_action(params: dict,
+                    rng,
+                    run: int,
+                    timesteps: int,
+                    on_timestep: Callable = None) -> list:
+    """
+    Call `p_user_action` on the last substep of every timestep, with the
+    history as given by cadCAD, and return the run buffer on each one.
+    The random states are kept rather than the predicted actions.
+    """
+    history = [[random_state(rng, run)]]
+    buffers = []
+    for _ in range(timesteps):
+        state = random_state(rng, run)
+        p_user_action(params, None, history, state)
+        buffers.append(ERROR_BUFFERS[run_key(state)])
+        if on_timestep is not None:
+            on_timestep()
+        history.append([state, dict(state, token_state=state['token_state'] * 1.01)])
+    return buffers
+
+
+def test_persistent_error_buffer():
+    """
+    Make sure that the error buffer of a run is kept across timesteps,
+    rather than being rebuilt from the whole history.
+    """
+    rng = np.random.default_rng(4)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(40)]
+    params = extrapolation_params(past_states)
+    buffers = run_user_action(params, rng, 5, 10)
+    assert all(buffer is buffers[0] for buffer in buffers)
+
+
+def test_power_transformer_refits(monkeypatch):
+    """
+    Make sure that the power transformer is only refitted as given by
+    its refit policy.
+    """
+    rng = np.random.default_rng(6)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(40)]
+    refits = []
+    refit = PowerTransformerCache.refit
+    monkeypatch.setattr(PowerTransformerCache, 'refit',
+                        lambda self, *args: refits.append(1) or refit(self, *args))
+
+    params = extrapolation_params(past_states, power_refit_interval=1000)
+    run_user_action(params, rng, 9, 8)
+    assert len(refits) == 1
+
+    refits.clear()
+    params = extrapolation_params(past_states, power_refit_interval=3)
+    run_user_action(params, rng, 10, 8)
+    assert len(refits) == 3
+
+
+def test_persistent_online_predictor(monkeypatch):
+    """
+    Make sure that the online predictor of a run is kept across timesteps
+    and updated with the new errors, rather than refitted.
+    """
+    rng = np.random.default_rng(7)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(40)]
+    fits = []
+    updates = []
+    fit = OnlineVAR.fit
+    update = OnlineVAR.update
+    monkeypatch.setattr(OnlineVAR, 'fit',
+                        lambda self, *args: fits.append(1) or fit(self, *args))
+    monkeypatch.setattr(OnlineVAR, 'update',
+                        lambda self, *args: updates.append(1) or update(self, *args))
+
+    params = extrapolation_params(past_states,
+                                  var_estimator='rls',
+                                  power_refit_interval=100)
+    predictors = []
+    run_user_action(params, rng, 6, 8,
+                    lambda: predictors.append(RUN_MODELS[(0, 0, 6, 'online_predictor')][2]))
+    assert all(predictor is predictors[0] for predictor in predictors)
+    assert len(fits) == 1
+    assert len(updates) > 0
+
+
+def test_flat_per_step_work(tmp_path, monkeypatch):
+    """
+    Make sure that every timestep only processes the new states, whether
+    the buffer continues a shared prefix or keeps a window.
+    """
+    rng = np.random.default_rng(5)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(40)]
+    user_action_params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    prefix = ActionErrorPrefix.from_states(past_states,
+                                           user_action_params,
+                                           0.8,
+                                           str(tmp_path / 'errors.npy'))
+
+    appends = []
+    append = ActionErrorBuffer.append
+    monkeypatch.setattr(ActionErrorBuffer, 'append',
+                        lambda self, state: appends.append(1) or append(self, state))
+    for (run, window) in ((7, None), (8, 10)):
+        params = extrapolation_params(past_states,
+                                      backtesting_error_prefix=prefix,
+                                      history_window=window)
+        appends_per_timestep = []
+        def on_timestep():
+            appends_per_timestep.append(len(appends))
+            appends.clear()
+        buffers = run_user_action(params, rng, run, 20, on_timestep)
+        assert buffers[0].shared_prefix is prefix
+
+        # The state after the last user action and the current one
+        assert appends_per_timestep == [2] * 20
+
+
+def test_deleted_error_prefix(tmp_path):
+    """
+    Make sure that a prefix whose file was deleted after its run is
+    ignored rather than failing, and that its buffers aren't reused.
+    """
+    rng = np.random.default_rng(8)
+    past_states = [state_to_action_state(random_state(rng))
+                   for _ in range(30)]
+    user_action_params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    path = tmp_path / 'errors.npy'
+    prefix = ActionErrorPrefix.from_states(past_states,
+                                           user_action_params,
+                                           0.8,
+                                           str(path))
+    params = extrapolation_params(past_states, backtesting_error_prefix=prefix)
+    buffers = run_user_action(params, rng, 11, 2)
+    assert buffers[0].shared_prefix is prefix
+
+    pickled_prefix = pickle.dumps(prefix)
+    path.unlink()
+    stale_prefix = pickle.loads(pickled_prefix)
+    assert stale_prefix.errors is None
+    assert not stale_prefix.matches(past_states, user_action_params, 0.8)
+
+    # A new simulation with the same run key rebuilds the buffer
+    params = extrapolation_params(past_states, backtesting_error_prefix=stale_prefix)
+    buffers = run_user_action(params, rng, 11, 2)
+    assert buffers[0].shared_prefix is None
+
+    clear_run_buffers()
+    assert len(ERROR_BUFFERS) == 0 and len(RUN_MODELS) == 0
@@ -1,10 +1,34 @@
 
 
-from rai_digital_twin.system_identification import fit_predict_action
+from rai_digital_twin.system_identification import ActionErrorBuffer, OnlineActionPredictor, PowerTransformerCache, predict_action
 from rai_digital_twin.types import ActionState, ControllerState, TokenState
 from cadCAD_tools.types import History, Params, Signal, State, VariableUpdate
+from collections import OrderedDict
+from typing import Callable
 from random import random
 from math import sqrt
+import numpy as np
+
+# Action error buffers for the runs being simulated, keyed by
+# (simulation, subset, run). Only the most recent ones are kept.
+ERROR_BUFFERS: OrderedDict = OrderedDict()
+MAX_ERROR_BUFFERS = 16
+
+# Models fitted over the error buffers, keyed by run and model name,
+# along with the buffer and the params they were built from
+RUN_MODELS: dict = {}
+
+
+def clear_run_buffers() -> None:
+    """
+    Drop the error buffers and run models of this process.
+    """
+    ERROR_BUFFERS.clear()
+    RUN_MODELS.clear()
+
+
+def run_key(state: State) -> tuple:
+    return (state.get('simulation'), state.get('subset'), state.get('run'))
 
 
 def state_to_action_state(state: State) -> ActionState:
@@ -32,6 +56,104 @@ def prepare_action_state_history(params: Params,
     return states_1 + states_2 + states_3
 
 
+def new_action_error_buffer(params: Params) -> ActionErrorBuffer:
+    past_states = params['backtesting_action_states']
+    prefix = params.get('backtesting_error_prefix', None)
+    if prefix is not None and prefix.matches(past_states,
+                                             params['user_action_params'],
+                                             params['ewm_alpha']):
+        # Continue from the errors which are shared by all runs
+        return ActionErrorBuffer.from_prefix(prefix, params['history_window'])
+    else:
+        return ActionErrorBuffer.from_states(past_states,
+                                             params['user_action_params'],
+                                             params['ewm_alpha'],
+                                             params['history_window'])
+
+
+def is_buffer_valid(buffer: ActionErrorBuffer,
+                    params: Params,
+                    history: History) -> bool:
+    """
+    Check that a buffer was built with the current params and follows the
+    same history, by comparing the states on its boundaries.
+    """
+    past_states = params['backtesting_action_states']
+    n_past = len(past_states)
+    if buffer.params != params['user_action_params']:
+        return False
+    elif buffer.ewm_alpha != params['ewm_alpha']:
+        return False
+    elif buffer.window != params['history_window']:
+        return False
+    elif (buffer.shared_prefix is not None
+          and buffer.shared_prefix is not params.get('backtesting_error_prefix', None)):
+        # Only continue the prefix of the current simulation
+        return False
+    elif buffer.size < n_past:
+        return False
+    elif n_past > 0 and buffer.prefix != (n_past, past_states[-1].token_state):
+        return False
+    elif buffer.size > n_past:
+        i = buffer.size - n_past - 1
+        return np.array_equal(buffer.token_state_at(buffer.size - 1),
+                              history[i][-1]['token_state'])
+    else:
+        return True
+
+
+def action_error_buffer(params: Params,
+                        history: History,
+                        state: State) -> ActionErrorBuffer:
+    """
+    Errors buffer over the same action states as
+    `prepare_action_state_history`, which is kept across timesteps so that
+    only the states which are new since the last call are processed.
+    """
+    key = run_key(state)
+    n_past = len(params['backtesting_action_states'])
+
+    # The last state on the previous call is superseded by its value
+    # after the user action, which is the last one on the history
+    buffer = ERROR_BUFFERS.get(key, None)
+    if buffer is not None:
+        if buffer.truncate(n_past + len(history) - 1) is False:
+            buffer = None
+
+    if buffer is None or is_buffer_valid(buffer, params, history) is False:
+        buffer = new_action_error_buffer(params)
+        ERROR_BUFFERS[key] = buffer
+        while len(ERROR_BUFFERS) > MAX_ERROR_BUFFERS:
+            ERROR_BUFFERS.popitem(last=False)
+    ERROR_BUFFERS.move_to_end(key)
+
+    buffer.extend(state_to_action_state(substep_states[-1])
+                  for substep_states in history[buffer.size - n_past:])
+    buffer.append(state_to_action_state(state))
+    return buffer
+
+
+def run_model(name: str,
+              config: tuple,
+              factory: Callable,
+              state: State,
+              buffer: ActionErrorBuffer) -> object:
+    """
+    Model kept across the timesteps of a run, which is rebuilt through
+    `factory(*config)` if the config or the run error buffer changes.
+    """
+    key = run_key(state) + (name,)
+    (last_buffer, last_config, model) = RUN_MODELS.get(key, (None, None, None))
+    if last_buffer is not buffer or last_config != config:
+        model = factory(*config)
+        RUN_MODELS[key] = (buffer, config, model)
+
+    # Drop the models of evicted buffers
+    for other_key in [k for k in RUN_MODELS if k[:3] not in ERROR_BUFFERS]:
+        del RUN_MODELS[other_key]
+    return model
+
+
 def p_user_action(params, _1, history, state) -> Signal:
     # Only run if the model is running on extrapolation mode
     if params['perform_backtesting'] is False:
@@ -39,16 +161,40 @@ def p_user_action(params, _1, history, state) -> Signal:
         # except for the last one.
 
         if params['use_ewm_model'] is True:
-            states = prepare_action_state_history(params,
-                                                history,
-                                                state)
-
-            ewm_action = fit_predict_action(states,
+            buffer = action_error_buffer(params, history, state)
+            if params['var_estimator'] == 'rls':
+                # The error for the current state isn't final until the
+                # user action is applied
+                predictor = run_model('online_predictor',
+                                      (params['var_lag'],
+                                       params['var_forgetting_factor'],
+                                       params['var_lag_criterion'],
+                                       params['power_refit_interval'],
+                                       params['power_refit_drift']),
+                                      OnlineActionPredictor,
+                                      state,
+                                      buffer)
+                errors = buffer.errors
+                ewm_action = predictor.predict(errors,
+                                               buffer.n_errors - 1,
+                                               state_to_action_state(state),
+                                               params['user_action_params'],
+                                               buffer.n_errors - len(errors))
+            else:
+                transformer_cache = run_model('power_transformer',
+                                              (params['power_refit_interval'],
+                                               params['power_refit_drift']),
+                                              PowerTransformerCache,
+                                              state,
+                                              buffer)
+                ewm_action = predict_action(buffer.errors,
+                                            state_to_action_state(state),
                                             params['user_action_params'],
-                                            params['ewm_alpha'],
-                                            params['var_lag'])
-            if ewm_action is None:
-                ewm_action = TokenState(0, 0, 0, 0)
+                                            params['var_lag'],
+                                            params['var_estimator'],
+                                            transformer_cache,
+                                            buffer.n_errors,
+                                            params['var_lag_criterion'])
         else:
             ewm_action = TokenState(0, 0, 0, 0)
 
@@ -1,9 +1,19 @@
+from typing import Iterator, Union
 import numpy as np
 import pandas as pd
 
-from rai_digital_twin.types import GovernanceEvent, GovernanceEventKind
+from rai_digital_twin.artifacts import DEFAULT_CHUNK_SIZE, iter_artifact_chunks, read_artifact
+from rai_digital_twin.timeline import TimelineIndex
+from rai_digital_twin.types import ActionState, GovernanceEvent, GovernanceEventKind
 from rai_digital_twin.types import Height, Timestep, TokenState, ControllerState
-from rai_digital_twin.types import BacktestingData
+from rai_digital_twin.types import BacktestingData, ArrayBacktestingData
+from rai_digital_twin.types import TimestepArray, TimestepColumns, TimestepRecords
+
+EXOGENOUS_MAP = {'eth_price': 'eth_price',
+                 'marketPriceUsd': 'market_price',
+                 'timestamp': 'timestamp'}
+
+TOKEN_STATE_COLUMNS = ('RaiInUniswap', 'EthInUniswap', 'debt', 'collateral')
 
 def row_to_controller_state(row: pd.Series) -> ControllerState:
     return ControllerState(row.RedemptionPrice,
@@ -23,10 +33,6 @@ def extract_exogenous_data(df: pd.DataFrame) -> dict[Timestep, dict[str, float]]
     """
     Extract exogenous variables from historical dataframe.
     """
-    EXOGENOUS_MAP = {'eth_price': 'eth_price',
-                     'marketPriceUsd': 'market_price',
-                     'timestamp': 'timestamp'}
-
     exogenous_data = (df.loc[:, EXOGENOUS_MAP.keys()]
                       .rename(columns=EXOGENOUS_MAP)
                       .to_dict(orient='index'))
@@ -37,8 +43,8 @@ def load_backtesting_data(path: str) -> BacktestingData:
     """
     Make the historical data clean for backtesting.
     """
-    # Load CSV file
-    df = (pd.read_csv(path, compression='gzip')
+    # Load historical data file
+    df = (read_artifact(path)
             .sort_values('block_number', ascending=True)
             .reset_index(drop=True)
             .assign(RedemptionRateHourlyRate=lambda df: df.RedemptionRateHourlyRate))
@@ -52,20 +58,115 @@ def load_backtesting_data(path: str) -> BacktestingData:
     return BacktestingData(token_states, exogenous_data, heights, pid_states)
 
 
-def retrieve_raw_events(params_df: pd.DataFrame,
-                        initial_height: Height) -> list[dict]:
+BACKTESTING_COLUMNS = (list(EXOGENOUS_MAP.keys())
+                       + list(TOKEN_STATE_COLUMNS)
+                       + ['block_number',
+                          'RedemptionPrice',
+                          'RedemptionRateHourlyRate'])
+
+
+def frame_to_array_backtesting_data(df: pd.DataFrame,
+                                    offset: Timestep = 0) -> ArrayBacktestingData:
+    """
+    Convert historical data ordered by block number into columnar
+    backtesting data, on which the first row is at the `offset` timestep.
+    """
+    token_states = TimestepRecords(df.loc[:, TOKEN_STATE_COLUMNS].to_numpy(np.float64),
+                                   TokenState._fields,
+                                   TokenState,
+                                   offset)
+    exogenous_data = TimestepColumns({new: df[old].to_numpy()
+                                      for (old, new) in EXOGENOUS_MAP.items()},
+                                     offset=offset)
+    heights = TimestepArray(df.block_number.to_numpy(np.int64), offset)
+
+    pid_array = np.full((len(df), 4), np.nan)
+    pid_array[:, 0] = df.RedemptionPrice.to_numpy(np.float64)
+    pid_array[:, 1] = df.RedemptionRateHourlyRate.to_numpy(np.float64)
+    pid_states = TimestepRecords(pid_array,
+                                 ControllerState._fields,
+                                 ControllerState,
+                                 offset)
+
+    return ArrayBacktestingData(token_states, exogenous_data, heights, pid_states)
+
+
+def load_array_backtesting_data(path: str) -> ArrayBacktestingData:
+    """
+    Make the historical data clean for backtesting, while keeping it
+    as contiguous columns rather than as per-timestep objects.
+    """
+    df = (read_artifact(path, columns=BACKTESTING_COLUMNS)
+            .sort_values('block_number', ascending=True, kind='stable')
+            .reset_index(drop=True))
+    return frame_to_array_backtesting_data(df)
+
+
+def iter_backtesting_data(path: str,
+                          chunksize: int = DEFAULT_CHUNK_SIZE,
+                          block_range: tuple[Height, Height] = None,
+                          timestamp_range: tuple[object, object] = None) -> Iterator[ArrayBacktestingData]:
+    """
+    Stream the historical data as consecutive chunks of columnar
+    backtesting data, keeping only the rows on the half-open block and
+    timestamp ranges. Timesteps are numbered across chunks, so that the
+    first chunk starts at 0 and every other one continues the previous.
+
+    The file must be ordered by block number, as written by `retrieve_data`.
+    """
+    if timestamp_range is not None:
+        (start, end) = (pd.Timestamp(t) for t in timestamp_range)
+
+    offset = 0
+    for df in iter_artifact_chunks(path,
+                                   BACKTESTING_COLUMNS,
+                                   chunksize,
+                                   block_range):
+        if timestamp_range is not None:
+            timestamps = pd.to_datetime(df.timestamp)
+            df = df[(timestamps >= start) & (timestamps < end)]
+        if len(df) == 0:
+            continue
+        df = (df.sort_values('block_number', ascending=True, kind='stable')
+                .reset_index(drop=True))
+        yield frame_to_array_backtesting_data(df, offset)
+        offset += len(df)
+
+
+def timestep_frame(data: dict[Timestep, object]) -> pd.DataFrame:
+    """
+    Convert per-timestep data on either dict or columnar form into a
+    DataFrame indexed by timestep.
+    """
+    if isinstance(data, TimestepColumns):
+        return data.to_frame()
+    else:
+        return pd.DataFrame.from_dict(data, orient='index')
+
+
+def historical_action_states(data: Union[BacktestingData, ArrayBacktestingData]) -> list[ActionState]:
+    """
+    Action states as seen on the historical data, for every timestep.
     """
+    return [ActionState(data.token_states[t],
+                        data.pid_states[t],
+                        data.exogenous_data[t]['market_price'],
+                        data.exogenous_data[t]['eth_price'])
+            for t in sorted(data.token_states.keys())]
 
+
+def retrieve_raw_events(params_df: list[dict],
+                        initial_height: Height) -> list[dict]:
     """
-    first_event = None
-    raw_events = []
-    for event in params_df:
-        eth_block = event['eth_block']
-        if eth_block < initial_height:
-            first_event = event
-        elif eth_block >= initial_height:
-            raw_events.append(event)
-    raw_events.insert(0, first_event)
+    Select the events from `initial_height` onwards, preceded by the
+    last event before it. Events must be ordered by `eth_block`.
+    """
+    eth_blocks = np.fromiter((event['eth_block'] for event in params_df),
+                             dtype=np.int64,
+                             count=len(params_df))
+    i = int(np.searchsorted(eth_blocks, initial_height, side='left'))
+    first_event = params_df[i - 1] if i > 0 else None
+    raw_events = [first_event] + params_df[i:]
     return raw_events
 
 
@@ -74,42 +175,37 @@ def interpolate_timestep(heights_per_timesteps: list[Height],
     """
     Note: heights per timestep must be ordered
     """
-    last_timestep = 0
-    for (_, height) in enumerate(heights_per_timesteps):
-        if height_to_interpolate >= height:
-            last_timestep += 1
-        else:
-            continue
-    return last_timestep
+    return int(np.searchsorted(heights_per_timesteps,
+                               height_to_interpolate,
+                               side='right'))
 
 
 def parse_raw_events(raw_events: list[dict],
-                     heights: dict[Timestep, Height]) -> dict[Timestep, GovernanceEvent]:
+                     timeline: TimelineIndex) -> dict[Timestep, GovernanceEvent]:
     # Map the raw events into (Timestep, GovernanceEvent) relations
-    height_list = list(heights.values())
+    event_heights = [int(raw_event['eth_block']) for raw_event in raw_events]
+    timesteps = timeline.heights_to_timesteps(event_heights)
     events = {}
-    for raw_event in raw_events:
+    for (raw_event, timestep) in zip(raw_events, timesteps):
         event = GovernanceEvent(GovernanceEventKind.change_pid_params,
                                 raw_event)
-        timestep = interpolate_timestep(
-            height_list, int(raw_event['eth_block']))
-        if timestep >= 0:
-            timestep = int(timestep)
-            events[timestep] = event
-        else:
-            continue
+        events[int(timestep)] = event
     return events
 
 
 def load_governance_events(path: str,
-                           heights: dict[Timestep, Height]) -> dict[Timestep, GovernanceEvent]:
+                           heights: Union[dict[Timestep, Height], TimelineIndex]) -> dict[Timestep, GovernanceEvent]:
 
     if len(heights) > 0:
+        if isinstance(heights, TimelineIndex):
+            timeline = heights
+        else:
+            timeline = TimelineIndex.from_heights(heights)
         params_df = pd.read_csv(path).sort_values(
             'eth_block').to_dict(orient='records')
-        initial_height = list(heights.values())[0]
+        initial_height = timeline.heights[0]
         raw_events = retrieve_raw_events(params_df, initial_height)
-        events = parse_raw_events(raw_events, heights)
+        events = parse_raw_events(raw_events, timeline)
         return events
     else:
         return {}
@@ -1,24 +1,197 @@
 import json
+import os
 import requests
 import logging
-from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep
+from requests.adapters import HTTPAdapter
 from tqdm.auto import tqdm
 from pandas.core.frame import DataFrame
-from typing import Iterable
+from typing import Callable, Iterable, Sequence, TypeVar, Union
 import pandas as pd
 
-RAI_SUBGRAPH_URL = 'https://api.thegraph.com/subgraphs/name/reflexer-labs/rai-mainnet'
+from rai_digital_twin.ingestion import BLOCK_STATE_SCHEMA, HOURLY_STATS_SCHEMA, ingest_pages
+from rai_digital_twin.data_cache import BlockCache, load_block_cache, save_block_cache
+from rai_digital_twin.data_cache import append_block_checkpoint
+from rai_digital_twin.data_cache import merge_intervals, missing_intervals, upsert_blocks
 
-def yield_hourly_stats(feed_size: int=1000) -> Iterable[dict]:
+# The endpoint can be overriden, eg. for pointing to a local stand-in
+RAI_SUBGRAPH_URL = os.environ.get('RAI_SUBGRAPH_URL',
+                                  'https://api.thegraph.com/subgraphs/name/reflexer-labs/rai-mainnet')
+
+# Maximum number of in-flight requests against the subgraph
+DEFAULT_MAX_WORKERS = 8
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+# Retry policy for throttled or failed queries
+DEFAULT_MAX_RETRIES = 8
+BACKOFF_BASE = 0.5  # Seconds
+BACKOFF_CAP = 60.0  # Seconds
+
+# HTTP status codes on which the request is retried
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AdaptiveRateLimiter():
+    """
+    Spaces out the requests sent by all threads of a session. The spacing
+    grows multiplicatively when the subgraph throttles or fails, and
+    shrinks slowly while requests succeed, so that the request rate settles
+    around the highest one that the subgraph sustains.
+    """
+
+    def __init__(self,
+                 min_delay: float = 0.0,
+                 max_delay: float = BACKOFF_CAP,
+                 increase_factor: float = 2.0,
+                 decrease_factor: float = 0.9):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.increase_factor = increase_factor
+        self.decrease_factor = decrease_factor
+        self.delay = min_delay
+        self._next_slot = 0.0
+        self._lock = Lock()
+
+    def wait(self) -> None:
+        """
+        Block until the next request slot is available.
+        """
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.delay
+        sleep(slot - now)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.delay = max(self.min_delay,
+                             self.delay * self.decrease_factor)
+
+    def on_throttle(self, retry_after: float = None) -> None:
+        with self._lock:
+            delay = max(self.delay * self.increase_factor, BACKOFF_BASE / 10)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            self.delay = min(self.max_delay, delay)
+
+
+def make_session(pool_size: int = DEFAULT_MAX_WORKERS,
+                 subgraph_url: str = None) -> requests.Session:
+    """
+    Create a HTTP session whose connection pool can hold `pool_size`
+    concurrent keep-alive connections to the subgraph. Requests sent
+    through `post_query` are paced by the session rate limiter and
+    are sent to `subgraph_url`, or to `RAI_SUBGRAPH_URL` if not given.
+    """
+    session = requests.Session()
+    session.subgraph_url = subgraph_url or RAI_SUBGRAPH_URL  # type: ignore
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.rate_limiter = AdaptiveRateLimiter()  # type: ignore
+    return session
+
+
+def retry_after_seconds(r: requests.Response) -> Union[float, None]:
+    value = r.headers.get('Retry-After', None)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def post_query(session: requests.Session,
+               query: str,
+               max_retries: int = DEFAULT_MAX_RETRIES) -> dict:
+    """
+    Send a GraphQL query to the RAI subgraph and return its data field.
+
+    Throttled (HTTP 429), failed (HTTP 5xx) or data-less responses are
+    retried with full-jitter exponential backoff.
+    """
+    url = getattr(session, 'subgraph_url', RAI_SUBGRAPH_URL)
+    rate_limiter = getattr(session, 'rate_limiter', None)
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+
+        retry_after = None
+        try:
+            r = session.post(url, json={'query': query})
+            if r.status_code in RETRY_STATUS_CODES:
+                retry_after = retry_after_seconds(r)
+                error: object = f"HTTP {r.status_code}"
+            else:
+                content = json.loads(r.content)
+                data = content.get('data', None)
+                if data is not None:
+                    if rate_limiter is not None:
+                        rate_limiter.on_success()
+                    return data
+                else:
+                    error = content.get('errors', content)
+        except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+            error = e
+
+        # Back off before trying again
+        if rate_limiter is not None:
+            rate_limiter.on_throttle(retry_after)
+        if attempt < max_retries:
+            backoff = uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            logging.warning(f"Subgraph query failed ({error}), retrying in {backoff :.2f}s")
+            sleep(backoff)
+
+    raise Exception(f"Subgraph query failed after {max_retries} retries: {error}")
+
+
+def fetch_concurrently(fetch: Callable[[T], R],
+                       items: Sequence[T],
+                       max_workers: int = DEFAULT_MAX_WORKERS,
+                       desc: str = None) -> list[R]:
+    """
+    Apply `fetch` over `items` using at most `max_workers` threads.
+    Results are returned on the same order as the input.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(tqdm(executor.map(fetch, items),
+                            total=len(items),
+                            desc=desc))
+    return results
+
+
+def to_unix_timestamp(value) -> int:
+    """
+    Convert a datetime-like value (naive values are assumed as UTC)
+    into seconds since the epoch.
+    """
+    return int(pd.Timestamp(value).timestamp())
+
+
+def yield_hourly_stats(feed_size: int = 1000,
+                       session: requests.Session = None,
+                       date_range: tuple[object, object] = None) -> Iterable[list[dict]]:
     """
     Generate a feed of hourly stats with timestamp, blockNumber, 
     and price fields.
+
+    Pages are retrieved by using the last seen timestamp as a cursor,
+    and the date range, if any, is filtered on the subgraph itself.
     """
+    if session is None:
+        session = make_session(1)
 
     # Query template
     query_header = '''
     query {{
-        hourlyStats(first: {}, skip:{}) {{'''
+        hourlyStats(first: {}, orderBy: timestamp, orderDirection: asc,
+                    where: {{{}}}) {{'''
 
     query_tail = '''    
     }
@@ -31,39 +204,47 @@ def yield_hourly_stats(feed_size: int=1000) -> Iterable[dict]:
         marketPriceEth # Price of COIN in ETH (uni pool price)
     '''
 
+    # Translate the date range into timestamp bounds
+    if date_range is not None:
+        cursor = to_unix_timestamp(date_range[0]) - 1
+        upper_filter = f', timestamp_lt: "{to_unix_timestamp(date_range[1])}"'
+    else:
+        cursor = -1
+        upper_filter = ''
+
     # Iterate until there's no yielded data
-    counter = count(0)
     while True:
-        position = next(counter) * feed_size
-
         # Prepare query
-        query = query_header.format(feed_size, position)
+        where = f'timestamp_gt: "{cursor}"' + upper_filter
+        query = query_header.format(feed_size, where)
         query += query_body
         query += query_tail
 
         # Send a POST request and parse
-        r = requests.post(RAI_SUBGRAPH_URL, json={'query': query})
-        s = json.loads(r.content)['data']['hourlyStats']
+        s = post_query(session, query)['hourlyStats']
 
         # Yield if there's data, else break
         if len(s) > 0:
             yield s
+            cursor = s[-1]['timestamp']
         else:
             break
 
+        # Short pages means that there's nothing left
+        if len(s) < feed_size:
+            break
+
 
-def retrieve_hourly_stats() -> DataFrame:
-    # Retrieve hourly stats batches and transform into a single list of dicts
-    gen_expr = (iter_hourly for
-                iter_hourly
-                in tqdm(yield_hourly_stats(),
-                        desc='Retrieving hourly stats'))
-    hourly_records: list[dict] = sum(gen_expr, [])
+def retrieve_hourly_stats(session: requests.Session = None,
+                          date_range: tuple[object, object] = None) -> DataFrame:
+    # Parse the hourly stats pages into typed columns as they arrive
+    pages = tqdm(yield_hourly_stats(session=session,
+                                    date_range=date_range),
+                 desc='Retrieving hourly stats')
+    hourly_columns = ingest_pages(pages, HOURLY_STATS_SCHEMA)
 
     # Clean-up to a pandas data frame
-    hourlyStats = (pd.DataFrame
-                   .from_records(hourly_records)
-                   .applymap(pd.to_numeric)
+    hourlyStats = (hourly_columns
                    .assign(timestamp=lambda df: pd.to_datetime(df.timestamp, unit='s'))
                    .assign(eth_price=lambda df: df.marketPriceUsd / df.marketPriceEth)
                    .set_index('blockNumber')
@@ -72,151 +253,434 @@ def retrieve_hourly_stats() -> DataFrame:
     return hourlyStats
 
 
-def retrieve_system_states(block_numbers: list[int]) -> DataFrame:
+SYSTEM_STATE_SELECTION = """
+    coinUniswapPair {
+      label
+      reserve0
+      reserve1
+      token0Price
+      token1Price
+      totalSupply
+    }
+    currentCoinMedianizerUpdate{
+      value
+    }
+    currentRedemptionRate {
+      eightHourlyRate
+      annualizedRate
+      hourlyRate
+      createdAt
+    }
+    currentRedemptionPrice {
+      value
+    }
+    erc20CoinTotalSupply
+    globalDebt
+    globalDebtCeiling
+    safeCount,
+    totalActiveSafeCount
+    coinAddress
+    wethAddress
+    systemSurplus
+    debtAvailableToSettle
+    lastPeriodicUpdate
+    createdAt
+    createdAtBlock
+"""
+
+# System-wide SAFE totals. RAI has ETH-A as its only collateral type.
+# `totalCollateralLockedInSafes` is updated along with the `collateral` of
+# every SAFE, while `totalCollateral` also counts the collateral which was
+# joined into the SAFEEngine without being locked on a SAFE, so only the
+# former is the sum of the SAFEs collateral.
+COLLATERAL_TOTALS_SELECTION = """
+    debtAmount
+    totalCollateralLockedInSafes
+"""
+
+# Aliased GraphQL fields for querying several block heights on one document
+BLOCK_FIELD_TEMPLATES = {
+    'system_state': 'state_%s: systemState(block: {number:%s},id:"current") {%s}',
+    'collateral_totals': 'collateral_%s: collateralType(block: {number:%s},id:"ETH-A") {%s}'
+}
+
+BLOCK_FIELD_SELECTIONS = {
+    'system_state': SYSTEM_STATE_SELECTION,
+    'collateral_totals': COLLATERAL_TOTALS_SELECTION
+}
+
+BLOCK_FIELD_ALIASES = {
+    'system_state': 'state_%s',
+    'collateral_totals': 'collateral_%s'
+}
+
+SAFES_PAGE_QUERY_TEMPLATE = """
+{
+  safes(block: {number:%s}, first: %s, orderBy: id, orderDirection: asc,
+        where: {id_gt: "%s"}) {
+    id
+    collateral
+    debt
+  }
+}
+"""
+
+# Maximum page size allowed by The Graph
+SAFES_PAGE_SIZE = 1000
+
+# Number of block heights to be requested on a single query
+DEFAULT_BLOCKS_PER_QUERY = 25
+
+# Number of block heights to be retrieved between checkpoints
+DEFAULT_CHECKPOINT_SIZE = 500
+
+
+def build_block_query(block_numbers: Sequence[int],
+                      fields: Sequence[str] = ('system_state', 'collateral_totals')) -> str:
     """
-    Retrieve a DataFrame representing the system state for all ETH
-    block heights given as a input.
+    Build a single GraphQL document that selects `fields` for every
+    block height on `block_numbers` by using field aliases.
     """
+    selections = []
+    for block_number in block_numbers:
+        for field in fields:
+            template = BLOCK_FIELD_TEMPLATES[field]
+            selection = BLOCK_FIELD_SELECTIONS[field]
+            selections.append(template % (block_number,
+                                          block_number,
+                                          selection))
+    query = '{\n' + '\n'.join(selections) + '\n}'
+    return query
+
+
+def split_block_response(data: dict,
+                         block_numbers: Sequence[int],
+                         fields: Sequence[str]) -> list[dict[str, object]]:
+    """
+    Split a aliased multi-block response back into one record per block
+    height, keyed by field.
+    """
+    records = []
+    for block_number in block_numbers:
+        record = {field: data[BLOCK_FIELD_ALIASES[field] % block_number]
+                  for field in fields}
+        record['block_number'] = block_number
+        records.append(record)
+    return records
+
+
+def query_block_batch(session: requests.Session,
+                      block_numbers: Sequence[int],
+                      fields: Sequence[str] = ('system_state', 'collateral_totals')) -> list[dict[str, object]]:
+    """
+    Retrieve `fields` for a batch of block heights through a single POST.
+    """
+    query = build_block_query(block_numbers, fields)
+    data = post_query(session, query)
+    return split_block_response(data, block_numbers, fields)
 
-    QUERY_TEMPLATE = """
-    {
-      systemState(block: {number:%s},id:"current") { 
-        coinUniswapPair {
-          label
-          reserve0
-          reserve1
-          token0Price
-          token1Price
-          totalSupply
-        }
-        currentCoinMedianizerUpdate{
-          value
-        }
-        currentRedemptionRate {
-          eightHourlyRate
-          annualizedRate
-          hourlyRate
-          createdAt
-        }
-        currentRedemptionPrice {
-          value
-        }
-        erc20CoinTotalSupply
-        globalDebt
-        globalDebtCeiling
-        safeCount,
-        totalActiveSafeCount
-        coinAddress
-        wethAddress
-        systemSurplus
-        debtAvailableToSettle
-        lastPeriodicUpdate
-        createdAt
-        createdAtBlock
-      }
-    }
+
+def chunks(items: Sequence[T], size: int) -> list[Sequence[T]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def query_blocks(block_numbers: list[int],
+                 fields: Sequence[str],
+                 session: requests.Session,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 blocks_per_query: int = DEFAULT_BLOCKS_PER_QUERY,
+                 desc: str = None) -> list[dict[str, object]]:
+    """
+    Retrieve `fields` for all block heights by sending batched queries
+    concurrently. Records are returned on the same order as the input.
     """
+    batches = chunks(block_numbers, blocks_per_query)
+    results = fetch_concurrently(partial(query_block_batch,
+                                         session,
+                                         fields=fields),
+                                 batches,
+                                 max_workers,
+                                 desc=desc)
+    return [record for batch in results for record in batch]
 
-    # Loop through system states
-    state = []
-    null_count = count(0)
-    for block_number in tqdm(block_numbers, desc='Retrieving System States'):
-        # Execute query
-        query = QUERY_TEMPLATE % block_number
-        r = requests.post(RAI_SUBGRAPH_URL, json={'query': query})
-        s = json.loads(r.content)['data']['systemState']
-        s['block_number'] = block_number
 
-        # Append if the row is valid, drop if coinUniswapPair info is missing
-        if s['coinUniswapPair'] is not None:
-            state.append(s)
-        else:
-            next(null_count)
-    
+def system_states_to_frame(records: list[dict]) -> DataFrame:
+    """
+    Parse block records with a system state into a DataFrame indexed
+    by block number.
+    """
+    # Drop rows on which the coinUniswapPair info is missing
+    valid_records = [record for record in records
+                     if record['system_state'] is not None
+                     and record['system_state']['coinUniswapPair'] is not None]
+
     # Warn if there are null rows
-    null_rows = next(null_count) - 1
+    null_rows = len(records) - len(valid_records)
     if null_rows > 0:
-        logging.warning(f"There are null coinUniswapPair rows, they were dropped. ({null_rows} null rows, {null_rows / (len(state) + null_rows): .2%} of total)")
-
-
-    # Transform output into a DataFrame
-    systemState = pd.DataFrame(state)
-    systemState = systemState.set_index('block_number')
-
-    # Extract nested data
-    systemState['RedemptionRateAnnualizedRate'] = systemState.currentRedemptionRate.apply(
-        lambda x: x['annualizedRate'])
-    systemState['RedemptionRateHourlyRate'] = systemState.currentRedemptionRate.apply(
-        lambda x: x['hourlyRate'])
-    systemState['RedemptionRateEightHourlyRate'] = systemState.currentRedemptionRate.apply(
-        lambda x: x['eightHourlyRate'])
-    systemState['RedemptionPrice'] = systemState.currentRedemptionPrice.apply(
-        lambda x: x['value'])
-    systemState['EthInUniswap'] = systemState.coinUniswapPair.apply(
-        lambda x: x['reserve1'])
-    systemState['RaiInUniswap'] = systemState.coinUniswapPair.apply(
-        lambda x: x['reserve0'])
-    systemState['RaiDrawnFromSAFEs'] = systemState['erc20CoinTotalSupply']
-
-    # Remove nested columns
-    del systemState['currentRedemptionRate']
-    del systemState['currentRedemptionPrice']
-
-    # Filter columns
-    systemState = systemState[['debtAvailableToSettle',
-                               'globalDebt',
-                               'globalDebtCeiling',
-                               'systemSurplus',
-                               'totalActiveSafeCount',
-                               'RedemptionRateAnnualizedRate',
-                               'RedemptionRateHourlyRate',
-                               'RedemptionRateEightHourlyRate',
-                               'RedemptionPrice',
-                               'EthInUniswap',
-                               'RaiInUniswap',
-                               'RaiDrawnFromSAFEs']]
+        logging.warning(f"There are null coinUniswapPair rows, they were dropped. ({null_rows} null rows, {null_rows / len(records): .2%} of total)")
+
+    # Parse into typed columns
+    systemState = (ingest_pages([valid_records],
+                                BLOCK_STATE_SCHEMA,
+                                capacity=len(valid_records))
+                   .set_index('block_number'))
     return systemState
 
 
-def retrieve_safe_history(block_numbers: list[int]) -> DataFrame:
-    safehistories = []
-    for i in tqdm(block_numbers, desc='Retrieving SAFEs History'):
-        query = '''
-        {
-        safes(block: {number:%s}) {
-                collateral
-                debt
-        }
-        }
-        ''' % i
-        r = requests.post(RAI_SUBGRAPH_URL, json={'query': query})
-        s = json.loads(r.content)['data']['safes']
-        t = pd.DataFrame(s)
-        t['collateral'] = t['collateral'].astype(float)
-        t['debt'] = t['debt'].astype(float)
-        safehistories.append(pd.DataFrame(t.sum().to_dict(), index=[0]))
-
-    safe_history = (pd.concat(safehistories)
+def aggregate_safes(session: requests.Session,
+                    block_number: int,
+                    page_size: int = SAFES_PAGE_SIZE) -> dict[str, float]:
+    """
+    Sum the collateral and debt over all SAFEs at a given block height.
+    SAFEs are paginated by id and summed as the pages arrive.
+    """
+    collateral = 0.0
+    debt = 0.0
+    cursor = ''
+    while True:
+        query = SAFES_PAGE_QUERY_TEMPLATE % (block_number, page_size, cursor)
+        page = post_query(session, query)['safes']
+        for safe in page:
+            collateral += float(safe['collateral'])
+            debt += float(safe['debt'])
+
+        if len(page) < page_size:
+            break
+        else:
+            cursor = page[-1]['id']
+    return {'collateral': collateral, 'debt': debt}
+
+
+def collateral_totals_to_safe_totals(totals: dict) -> Union[dict[str, float], None]:
+    """
+    Totals as returned by `aggregate_safes` out of the ETH-A collateral
+    type. `debtAmount` is the sum of the SAFEs `debt`, and
+    `totalCollateralLockedInSafes` the sum of their `collateral`.
+    """
+    if totals is None:
+        return None
+    elif totals['totalCollateralLockedInSafes'] is None or totals['debtAmount'] is None:
+        return None
+    else:
+        return {'collateral': float(totals['totalCollateralLockedInSafes']),
+                'debt': float(totals['debtAmount'])}
+
+
+def complete_safe_totals(safe_totals: list[Union[dict[str, float], None]],
+                         block_numbers: list[int],
+                         session: requests.Session,
+                         max_workers: int = DEFAULT_MAX_WORKERS) -> list[dict[str, float]]:
+    """
+    Fill the blocks without system-wide totals by enumerating their SAFEs.
+    """
+    missing = [i for (i, totals) in enumerate(safe_totals) if totals is None]
+    if len(missing) > 0:
+        aggregates = fetch_concurrently(partial(aggregate_safes, session),
+                                        [block_numbers[i] for i in missing],
+                                        max_workers,
+                                        desc='Aggregating SAFEs')
+        safe_totals = list(safe_totals)
+        for (i, aggregate) in zip(missing, aggregates):
+            safe_totals[i] = aggregate
+    return safe_totals
+
+
+def safe_totals_to_frame(safe_totals: list[dict[str, float]],
+                         block_numbers: list[int]) -> DataFrame:
+    safe_history = (pd.DataFrame(safe_totals, columns=['collateral', 'debt'])
                     .assign(block_number=block_numbers)
                     .set_index('block_number')
                     )
     return safe_history
 
 
+def retrieve_system_states(block_numbers: list[int],
+                           session: requests.Session = None,
+                           max_workers: int = DEFAULT_MAX_WORKERS) -> DataFrame:
+    """
+    Retrieve a DataFrame representing the system state for all ETH
+    block heights given as a input.
+    """
+    if session is None:
+        session = make_session(max_workers)
+    records = query_blocks(block_numbers,
+                           ('system_state',),
+                           session,
+                           max_workers,
+                           desc='Retrieving System States')
+    return system_states_to_frame(records)
+
+
+def retrieve_safe_history(block_numbers: list[int],
+                          session: requests.Session = None,
+                          max_workers: int = DEFAULT_MAX_WORKERS,
+                          use_system_totals: bool = True,
+                          subgraph_url: str = None) -> DataFrame:
+    """
+    Retrieve the total SAFEs collateral and debt for all ETH block heights
+    given as a input. System-wide totals are used when available, and
+    the SAFEs are enumerated otherwise. If no session is given, queries
+    are sent to `subgraph_url`.
+    """
+    if session is None:
+        session = make_session(max_workers, subgraph_url)
+
+    if use_system_totals is True:
+        records = query_blocks(block_numbers,
+                               ('collateral_totals',),
+                               session,
+                               max_workers,
+                               desc='Retrieving SAFEs History')
+        safe_totals = [collateral_totals_to_safe_totals(record['collateral_totals'])
+                       for record in records]
+    else:
+        safe_totals = [None] * len(block_numbers)
+
+    safe_totals = complete_safe_totals(safe_totals,
+                                       block_numbers,
+                                       session,
+                                       max_workers)
+    return safe_totals_to_frame(safe_totals, block_numbers)
+
+
+def retrieve_block_states(block_numbers: list[int],
+                          session: requests.Session = None,
+                          max_workers: int = DEFAULT_MAX_WORKERS,
+                          blocks_per_query: int = DEFAULT_BLOCKS_PER_QUERY,
+                          use_system_totals: bool = True) -> tuple[DataFrame, DataFrame]:
+    """
+    Retrieve both the system state and the SAFEs history for all ETH
+    block heights given as a input, by requesting both on the same
+    batched queries.
+    """
+    if session is None:
+        session = make_session(max_workers)
+
+    if use_system_totals is True:
+        fields: tuple[str, ...] = ('system_state', 'collateral_totals')
+    else:
+        fields = ('system_state',)
+
+    records = query_blocks(block_numbers,
+                           fields,
+                           session,
+                           max_workers,
+                           blocks_per_query,
+                           desc='Retrieving System States & SAFEs')
+    safe_totals = [collateral_totals_to_safe_totals(record.get('collateral_totals'))
+                   for record in records]
+    safe_totals = complete_safe_totals(safe_totals,
+                                       block_numbers,
+                                       session,
+                                       max_workers)
+    return (system_states_to_frame(records),
+            safe_totals_to_frame(safe_totals, block_numbers))
+
+
+def retrieve_cached_hourly_stats(cache: BlockCache,
+                                 session: requests.Session,
+                                 date_range: tuple[object, object] = None) -> DataFrame:
+    """
+    Retrieve the hourly stats inside the date range by requesting only
+    the time intervals which aren't covered by the local store yet.
+    """
+    if date_range is not None:
+        window = (to_unix_timestamp(date_range[0]),
+                  to_unix_timestamp(date_range[1]))
+    else:
+        window = (0, to_unix_timestamp(pd.Timestamp.max))
+
+    for (start, end) in missing_intervals(cache.hourly_stats_coverage, window):
+        interval_range = (pd.Timestamp(start, unit='s'),
+                          pd.Timestamp(end, unit='s'))
+        new_stats = retrieve_hourly_stats(session, interval_range)
+        cache.hourly_stats = upsert_blocks(cache.hourly_stats, new_stats)
+
+        # Only the span up to the last retrieved row is known to be complete,
+        # as the subgraph may not have indexed the most recent hours yet
+        if len(new_stats) > 0:
+            covered_end = to_unix_timestamp(new_stats.timestamp.max()) + 1
+            coverage = cache.hourly_stats_coverage + [(start, covered_end)]
+            cache.hourly_stats_coverage = merge_intervals(coverage)
+
+    timestamps = cache.hourly_stats.timestamp
+    in_window = (timestamps >= pd.Timestamp(window[0], unit='s'))
+    in_window &= (timestamps < pd.Timestamp(window[1], unit='s'))
+    return cache.hourly_stats[in_window]
+
+
+def retrieve_cached_block_states(cache: BlockCache,
+                                 block_numbers: list[int],
+                                 session: requests.Session,
+                                 max_workers: int = DEFAULT_MAX_WORKERS,
+                                 blocks_per_query: int = DEFAULT_BLOCKS_PER_QUERY,
+                                 use_system_totals: bool = True,
+                                 checkpoint_size: int = DEFAULT_CHECKPOINT_SIZE) -> tuple[DataFrame, DataFrame]:
+    """
+    Retrieve the system states and SAFEs history for the given block
+    heights by requesting only the heights which aren't on the local store.
+
+    Heights are retrieved in groups of `checkpoint_size`, and every group
+    is checkpointed on the store as soon as it is complete, so that an
+    interrupted retrieval resumes from where it stopped.
+    """
+    cached_blocks = set(cache.system_states.index)
+    cached_blocks &= set(cache.safe_history.index)
+    missing_blocks = [block_number
+                      for block_number in block_numbers
+                      if block_number not in cached_blocks]
+
+    new_system_states = []
+    new_safe_history = []
+    for group in chunks(missing_blocks, checkpoint_size):
+        system_states, safe_history = retrieve_block_states(group,
+                                                            session,
+                                                            max_workers,
+                                                            blocks_per_query,
+                                                            use_system_totals)
+        append_block_checkpoint(cache, system_states, safe_history)
+        new_system_states.append(system_states)
+        new_safe_history.append(safe_history)
+
+    if len(missing_blocks) > 0:
+        cache.system_states = upsert_blocks(cache.system_states,
+                                            pd.concat(new_system_states))
+        cache.safe_history = upsert_blocks(cache.safe_history,
+                                           pd.concat(new_safe_history))
+
+    system_states = cache.system_states
+    safe_history = cache.safe_history
+    return (system_states[system_states.index.isin(block_numbers)],
+            safe_history[safe_history.index.isin(block_numbers)])
+
+
 def download_data(limit=None,
-                  date_range=None) -> DataFrame:
+                  date_range=None,
+                  max_workers: int = DEFAULT_MAX_WORKERS,
+                  blocks_per_query: int = DEFAULT_BLOCKS_PER_QUERY,
+                  cache_path: str = None,
+                  use_system_totals: bool = True,
+                  subgraph_url: str = None) -> DataFrame:
     """
     Retrieve all historical data required for backtesting & extrapolation
+
+    If `cache_path` is given, then only the data which is not on the
+    local store at that path is downloaded, and the store is updated
+    with it afterwards. If `use_system_totals` is False, then the SAFE
+    totals are always computed by enumerating every SAFE.
     """
-    # Get hourly stats from The Graph
-    hourly_stats = retrieve_hourly_stats()
+    # Share a single connection pool across all queries
+    session = make_session(max_workers, subgraph_url)
 
-    # Filter hourly date if requested, else, use everything
-    if date_range is not None:
-        QUERY = f'timestamp >= "{date_range[0]}" & timestamp < "{date_range[1]}"'
-        hourly_stats = hourly_stats.query(QUERY)
+    # Get hourly stats from The Graph, filtered by date if requested
+    if cache_path is None:
+        cache = None
+        hourly_stats = retrieve_hourly_stats(session, date_range)
     else:
-        pass
+        cache = load_block_cache(cache_path)
+        hourly_stats = retrieve_cached_hourly_stats(cache,
+                                                    session,
+                                                    date_range)
 
     # Get the first hourly results if requested
     if limit is not None:
@@ -225,11 +689,25 @@ def download_data(limit=None,
         pass
 
     # Retrieve block numbers
-    block_numbers = hourly_stats.index
+    block_numbers = list(hourly_stats.index)
     
     # Get associated system states & safe state for each block numbers
-    dfs = (retrieve_system_states(block_numbers),
-           retrieve_safe_history(block_numbers),
+    if cache is None:
+        system_states, safe_history = retrieve_block_states(block_numbers,
+                                                            session,
+                                                            max_workers,
+                                                            blocks_per_query,
+                                                            use_system_totals)
+    else:
+        system_states, safe_history = retrieve_cached_block_states(cache,
+                                                                   block_numbers,
+                                                                   session,
+                                                                   max_workers,
+                                                                   blocks_per_query,
+                                                                   use_system_totals)
+        save_block_cache(cache)
+    dfs = (system_states,
+           safe_history,
            hourly_stats)
 
     # Join everything together
@@ -6,7 +6,12 @@ import pandas as pd
 import numpy as np
 from dataclasses import dataclass
 from scipy.stats import gamma
-import pymc3 as pm
+from time import perf_counter
+
+# Methods for fitting the ETH price distribution. 'advi' and 'nuts' are
+# Bayesian and require `pymc3`
+FIT_METHODS = ('moments', 'mle', 'advi', 'nuts')
+DEFAULT_FIT_METHOD = 'mle'
 
 
 @dataclass
@@ -15,6 +20,13 @@ class FitParams():
     scale: float
 
 
+@dataclass(frozen=True)
+class FitResult():
+    params: FitParams
+    method: str
+    wall_seconds: float
+
+
 @dataclass
 class FilterState():
     xhat: list[float]
@@ -168,32 +180,102 @@ def generate_eth_samples(fit_params: FitParams,
         yield xhat
 
 
-def fit_eth_price(X: np.ndarray) -> FitParams:
+def fit_eth_price_moments(X: np.ndarray) -> FitParams:
     """
-    Perform Bayesian Inference on the ETH time series
+    Closed-form method of moments estimate of the gamma distribution
+    """
+    mean = np.mean(X)
+    variance = np.var(X)
+    return FitParams(shape=float(mean ** 2 / variance),
+                     scale=float(variance / mean))
+
+
+def fit_eth_price_mle(X: np.ndarray) -> FitParams:
+    """
+    Maximum likelihood estimate of the gamma distribution
     """
+    (shape, _, scale) = gamma.fit(X, floc=0)
+    return FitParams(shape=float(shape), scale=float(scale))
+
+
+def posterior_fit_params(alpha: object, beta: object) -> FitParams:
+    """
+    Fit params out of the posterior means of the gamma rate
+    parametrization. Samples can be arrays or `xarray.DataArray`s, but the
+    params are always plain floats.
+    """
+    a = float(np.mean(alpha))
+    b = float(np.mean(beta))
+    return FitParams(shape=a, scale=1 / b)
+
+
+def eth_price_model(X: np.ndarray):
+    import pymc3 as pm
     model = pm.Model()
     with model:
         alpha = pm.Exponential('alpha', lam=2)
         beta = pm.Exponential('beta', lam=.1)
         g = pm.Gamma('g', alpha=alpha, beta=beta, observed=X)
+    return model
+
+
+def fit_eth_price_advi(X: np.ndarray) -> FitParams:
+    """
+    Perform Variational Inference on the ETH time series
+    """
+    import pymc3 as pm
+    with eth_price_model(X):
+        approximation = pm.fit(n=20000, method='advi')
+        trace = approximation.sample(5000)
+    return posterior_fit_params(trace['alpha'], trace['beta'])
+
+
+def fit_eth_price_nuts(X: np.ndarray) -> FitParams:
+    """
+    Perform Bayesian Inference on the ETH time series
+    """
+    import pymc3 as pm
+    with eth_price_model(X):
         # BUG: we're limited for 1 core for now
         trace = pm.sample(5000, return_inferencedata=True, cores=1)
+    return posterior_fit_params(trace.posterior.alpha, trace.posterior.beta)
+
 
-    
-    a = np.mean(trace.posterior.alpha)
-    b = np.mean(trace.posterior.beta)
+FIT_BACKENDS = {'moments': fit_eth_price_moments,
+                'mle': fit_eth_price_mle,
+                'advi': fit_eth_price_advi,
+                'nuts': fit_eth_price_nuts}
 
-    fit_params = FitParams(shape=a, scale=1 / b)
-    return fit_params
+
+def timed_fit_eth_price(X: np.ndarray,
+                        method: str = DEFAULT_FIT_METHOD) -> FitResult:
+    """
+    Fit the ETH price distribution while measuring the wall time.
+    """
+    if method not in FIT_BACKENDS:
+        raise ValueError(f"Unknown fitting method {method}")
+    X = np.asarray(X, dtype=float)
+    start = perf_counter()
+    params = FIT_BACKENDS[method](X)
+    return FitResult(params, method, perf_counter() - start)
+
+
+def fit_eth_price(X: np.ndarray,
+                  method: str = DEFAULT_FIT_METHOD) -> FitParams:
+    """
+    Fit a gamma distribution on the ETH time series through one of
+    the `FIT_METHODS`
+    """
+    return timed_fit_eth_price(X, method).params
 
 
 def fit_predict_eth_price(X: np.ndarray,
                           timesteps: int,
                           samples: int,
-                          initial_value: USD_per_ETH) -> tuple[np.ndarray, ...]:
+                          initial_value: USD_per_ETH,
+                          method: str = DEFAULT_FIT_METHOD) -> tuple[np.ndarray, ...]:
 
-    fit_params = fit_eth_price(X)
+    fit_params = fit_eth_price(X, method)
     results = tuple(generate_eth_samples(fit_params,
                                          timesteps,
                                          samples,
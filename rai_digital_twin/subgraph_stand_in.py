@@ -0,0 +1,258 @@
+"""
+subgraph_stand_in.py
+
+Local stand-in for the RAI subgraph, serving `hourlyStats`,
+`systemState(block:)`, `collateralType(block:)` and `safes(block:)` from a
+recorded retrieval file, so that `retrieve_data` can be exercised and
+benchmarked without the live The Graph endpoint.
+
+Only the query shapes which are sent by `retrieve_data` are understood:
+every top-level field must have arguments, and the selections are ignored
+in favor of returning every known field.
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from random import random
+from threading import Thread
+from time import sleep
+from typing import Iterator, Union
+import json
+import re
+import click
+import numpy as np
+import pandas as pd
+
+from rai_digital_twin.artifacts import find_last_artifact, read_artifact
+
+# Top-level aliased fields with arguments, eg. `state_1: systemState(...)`
+FIELD_PATTERN = re.compile(r'(?:(\w+)\s*:\s*)?(\w+)\s*\(([^)]*)\)')
+FILTER_PATTERN = re.compile(r'(\w+)_(gt|gte|lt|lte)\s*:\s*"?([\w.-]*)"?')
+COMMENT_PATTERN = re.compile(r'#[^\n]*')
+# Collateral which is joined to the system but not locked on SAFEs, as a
+# share of the locked one
+UNLOCKED_COLLATERAL_SHARE = 0.1
+
+
+def find_last_fixture(path: str = 'data/runs') -> Path:
+    """
+    Find the most recent retrieval file at `path`.
+    """
+    return find_last_artifact(path, 'retrieval')
+
+
+def load_fixture(path: str) -> pd.DataFrame:
+    """
+    Load a retrieval file as recorded by `extrapolation_cycle`.
+    """
+    df = (read_artifact(path)
+          .assign(timestamp=lambda df: pd.to_datetime(df.timestamp))
+          .sort_values('block_number')
+          .set_index('block_number'))
+    df['unix_timestamp'] = df.timestamp.astype('datetime64[s]').astype(int)
+    return df
+
+
+class SubgraphStandIn():
+    """
+    Resolves subgraph queries over a fixture indexed by block number.
+    """
+
+    def __init__(self,
+                 fixture: pd.DataFrame,
+                 safes_per_block: int = 150,
+                 expose_totals: bool = True):
+        self.fixture = fixture
+        self.blocks = fixture.index.values
+        self.safes_per_block = safes_per_block
+        self.expose_totals = expose_totals
+
+    def row_at(self, block_number: int) -> Union[pd.Series, None]:
+        """
+        Last recorded row at or before a block height.
+        """
+        i = np.searchsorted(self.blocks, block_number, side='right') - 1
+        return self.fixture.iloc[i] if i >= 0 else None
+
+    def hourly_stats(self, args: str) -> list[dict]:
+        df = self.fixture
+        for (field, op, value) in FILTER_PATTERN.findall(args):
+            column = df.unix_timestamp if field == 'timestamp' else df.index
+            value = int(value)
+            if op == 'gt':
+                df = df[column > value]
+            elif op == 'gte':
+                df = df[column >= value]
+            elif op == 'lt':
+                df = df[column < value]
+            else:
+                df = df[column <= value]
+        skip = int_argument(args, 'skip', 0)
+        first = int_argument(args, 'first', 100)
+        df = df.sort_values('unix_timestamp').iloc[skip:skip + first]
+        return [{'timestamp': str(row.unix_timestamp),
+                 'blockNumber': str(block_number),
+                 'marketPriceUsd': str(row.marketPriceUsd),
+                 'marketPriceEth': str(row.marketPriceEth)}
+                for (block_number, row) in df.iterrows()]
+
+    def system_state(self, args: str) -> Union[dict, None]:
+        row = self.row_at(int_argument(args, 'number'))
+        if row is None:
+            return None
+        rai_price = row.EthInUniswap / row.RaiInUniswap
+        return {
+            'coinUniswapPair': {'label': 'RAI/WETH',
+                                'reserve0': str(row.RaiInUniswap),
+                                'reserve1': str(row.EthInUniswap),
+                                'token0Price': str(1 / rai_price),
+                                'token1Price': str(rai_price),
+                                'totalSupply': '0'},
+            'currentCoinMedianizerUpdate': {'value': str(row.marketPriceUsd)},
+            'currentRedemptionRate': {'eightHourlyRate': str(row.RedemptionRateEightHourlyRate),
+                                      'annualizedRate': str(row.RedemptionRateAnnualizedRate),
+                                      'hourlyRate': str(row.RedemptionRateHourlyRate),
+                                      'createdAt': str(row.unix_timestamp)},
+            'currentRedemptionPrice': {'value': str(row.RedemptionPrice)},
+            'erc20CoinTotalSupply': str(row.RaiDrawnFromSAFEs),
+            'globalDebt': str(row.globalDebt),
+            'globalDebtCeiling': str(row.globalDebtCeiling),
+            'safeCount': str(row.totalActiveSafeCount),
+            'totalActiveSafeCount': str(row.totalActiveSafeCount),
+            'coinAddress': '0x0',
+            'wethAddress': '0x0',
+            'systemSurplus': str(row.systemSurplus),
+            'debtAvailableToSettle': str(row.debtAvailableToSettle),
+            'lastPeriodicUpdate': str(row.unix_timestamp),
+            'createdAt': str(row.unix_timestamp),
+            'createdAtBlock': str(row.name)
+        }
+
+    def collateral_type(self, args: str) -> Union[dict, None]:
+        row = self.row_at(int_argument(args, 'number'))
+        if row is None or self.expose_totals is False:
+            return None
+        # The collateral which isn't locked on SAFEs isn't recorded, so
+        # it is made up in order for the two totals to differ
+        total_collateral = row.collateral * (1 + UNLOCKED_COLLATERAL_SHARE)
+        return {'debtAmount': str(row.debt),
+                'totalCollateral': str(total_collateral),
+                'totalCollateralLockedInSafes': str(row.collateral)}
+
+    def safes(self, args: str) -> list[dict]:
+        """
+        SAFEs which evenly split the recorded totals.
+        """
+        row = self.row_at(int_argument(args, 'number'))
+        if row is None:
+            return []
+        n = self.safes_per_block
+        ids = [f'{i:08d}' for i in range(n)]
+        cursor = re.search(r'id_gt\s*:\s*"(\w*)"', args)
+        if cursor is not None:
+            ids = [i for i in ids if i > cursor.group(1)]
+        ids = ids[:int_argument(args, 'first', 100)]
+        return [{'id': i,
+                 'collateral': str(row.collateral / n),
+                 'debt': str(row.debt / n)}
+                for i in ids]
+
+    def resolve(self, query: str) -> dict:
+        resolvers = {'hourlyStats': self.hourly_stats,
+                     'systemState': self.system_state,
+                     'collateralType': self.collateral_type,
+                     'safes': self.safes}
+        data = {}
+        query = COMMENT_PATTERN.sub('', query)
+        for (alias, field, args) in FIELD_PATTERN.findall(query):
+            data[alias or field] = resolvers[field](args)
+        return data
+
+
+def int_argument(args: str, name: str, default: int = None) -> int:
+    match = re.search(name + r'\s*:\s*(\d+)', args)
+    return int(match.group(1)) if match is not None else default
+
+
+def make_stand_in_server(stand_in: SubgraphStandIn,
+                         host: str = '127.0.0.1',
+                         port: int = 0,
+                         latency: float = 0.0,
+                         error_rate: float = 0.0,
+                         error_status: int = 429) -> ThreadingHTTPServer:
+    """
+    Create a HTTP server for the stand-in. Every request is delayed by
+    `latency` seconds, and answered with `error_status` with probability
+    `error_rate`.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers['Content-Length'])
+            query = json.loads(self.rfile.read(length))['query']
+            sleep(latency)
+
+            if random() < error_rate:
+                status = error_status
+                body = {'errors': [{'message': 'Injected error'}]}
+            else:
+                status = 200
+                body = {'data': stand_in.resolve(query)}
+
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+@contextmanager
+def running_stand_in(stand_in: SubgraphStandIn,
+                     **server_kwargs) -> Iterator[str]:
+    """
+    Serve the stand-in on a background thread and yield its URL.
+    """
+    server = make_stand_in_server(stand_in, **server_kwargs)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        (host, port) = server.server_address[:2]
+        yield f'http://{host}:{port}/'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@click.command()
+@click.option('-f', '--fixture', 'fixture_path',
+              default=None,
+              help="Retrieval file to be served. Defaults to the last one at data/runs")
+@click.option('-p', '--port', 'port',
+              default=8000,
+              help="Port to listen on")
+@click.option('--latency', 'latency',
+              default=0.0,
+              help="Delay in seconds added to every request")
+@click.option('--error-rate', 'error_rate',
+              default=0.0,
+              help="Fraction of requests answered with an error")
+def main(fixture_path, port, latency, error_rate) -> None:
+    if fixture_path is None:
+        fixture_path = find_last_fixture()
+    stand_in = SubgraphStandIn(load_fixture(fixture_path))
+    server = make_stand_in_server(stand_in,
+                                  port=port,
+                                  latency=latency,
+                                  error_rate=error_rate)
+    print(f"Serving {fixture_path} at http://127.0.0.1:{port}/")
+    print(f"Use it with RAI_SUBGRAPH_URL=http://127.0.0.1:{port}/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 from dataclasses import dataclass
 from typing import Iterable, Union
 from numpy import ndarray
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
 from statsmodels.tsa.api import VAR
 import pandas as pd
 from sklearn.preprocessing import PowerTransformer
 
 from rai_digital_twin.types import ActionState, ControllerState, ETH, ETH_per_RAI, OptimalAction, Percentage, RAI, TokenState, TransformedTokenState, USD_per_ETH, USD_per_RAI, UserActionParams
-from rai_digital_twin.types import coordinate_transform, reverse_coordinate_transform
+from rai_digital_twin.types import coordinate_transform_batch, reverse_coordinate_transform, reverse_coordinate_transform_batch
 
 
 def arbitrageur_action_options(RAI_balance: RAI,
@@ -88,19 +90,107 @@ def arbitrageur_action(token_state: TokenState,
     return action
 
 
+def compute_arbitrageur_action_batch(token_states: ndarray,
+                                     fee_survival: Percentage,
+                                     liquidation_prices: ndarray,
+                                     expensive_threshold: Percentage,
+                                     cheap_threshold: Percentage,
+                                     relative_redemption_prices: ndarray,
+                                     optimal_borrows: ndarray,
+                                     optimal_repays: ndarray) -> ndarray:
+    """
+    Vectorized `compute_arbitrageur_action`. Both the borrow and the repay
+    actions are computed for every state, and the one to be taken is
+    selected through masks.
+    """
+    (rai_reserve, eth_reserve, rai_debt, eth_locked) = np.moveaxis(token_states, -1, 0)
+    borrow = relative_redemption_prices <= expensive_threshold
+    repay = ~borrow & (relative_redemption_prices >= cheap_threshold)
+
+    # The branch which isn't taken can divide by zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        borrow_d = (optimal_borrows - rai_reserve) / fee_survival
+        borrow_q = liquidation_prices * (rai_debt + borrow_d) - eth_locked
+        borrow_z = -1 * (eth_reserve * borrow_d * fee_survival)
+        borrow_z /= (rai_reserve + borrow_d * fee_survival)
+
+        repay_z = (optimal_repays - eth_reserve) / fee_survival
+        repay_r = -1 * (rai_reserve * repay_z * fee_survival)
+        repay_r /= (eth_reserve + repay_z * fee_survival)
+        repay_q = liquidation_prices * (rai_debt + repay_r) - eth_locked
+
+    r = np.where(borrow, borrow_d, np.where(repay, repay_r, 0.0))
+    z = np.where(borrow, borrow_z, np.where(repay, repay_z, 0.0))
+    q = np.where(borrow, borrow_q, np.where(repay, repay_q, 0.0))
+    # The RAI debt changes as much as the RAI reserve
+    return np.stack([r, z, r, q], axis=-1)
+
+
+def arbitrageur_action_batch(token_states: ndarray,
+                             redemption_prices: ndarray,
+                             market_prices: ndarray,
+                             eth_prices: ndarray,
+                             params: UserActionParams) -> ndarray:
+    """
+    Vectorized `arbitrageur_action` over arrays of states. Token states have
+    the `TokenState` fields on the last axis, and the prices are
+    broadcasted against the remaining ones. Returns the actions with the
+    same layout as the token states.
+    """
+    token_states = np.asarray(token_states, dtype=float)
+    redemption_prices = np.asarray(redemption_prices, dtype=float)
+
+    fee_survival = (1 - params.uniswap_fee)
+    liquidation_prices = params.liquidation_ratio * redemption_prices
+    liquidation_prices = liquidation_prices / np.asarray(eth_prices, dtype=float)
+
+    if params.consider_liquidation_ratio is True:
+        expensive_threshold = fee_survival / params.liquidation_ratio
+        cheap_threshold = fee_survival * params.liquidation_ratio
+    else:
+        expensive_threshold = fee_survival
+        cheap_threshold = 1 / fee_survival
+
+    relative_redemption_prices = redemption_prices / np.asarray(market_prices,
+                                                                dtype=float)
+
+    optimal_actions = arbitrageur_action_options(token_states[..., 0],
+                                                 token_states[..., 1],
+                                                 liquidation_prices,
+                                                 params.uniswap_fee)
+
+    return compute_arbitrageur_action_batch(token_states,
+                                            fee_survival,
+                                            liquidation_prices,
+                                            expensive_threshold,
+                                            cheap_threshold,
+                                            relative_redemption_prices,
+                                            optimal_actions.borrow,
+                                            optimal_actions.repay)
+
+
+VAR_BACKENDS = ('statsmodels', 'numpy')
+
+
 def VAR_prediction(errors: list[list[float]],
-                   lag: int = 15) -> ndarray:
+                   lag: int = 15,
+                   backend: str = 'statsmodels') -> ndarray:
     '''
     Description:
     Function to train and forecast a VAR model one step into the future
     Parameters:
     e_u: errors pandas dataframe
     lag: number of autoregressive lags. Default is 1
+    backend: 'statsmodels', or 'numpy' for `numpy_VAR_prediction`
     Returns:
     Numpy array of transformed state changes
     Example
     VAR_prediction(e_u,6)
     '''
+    if backend == 'numpy':
+        return numpy_VAR_prediction(errors, lag)
+    elif backend != 'statsmodels':
+        raise ValueError(f"Unknown VAR backend {backend}")
     # instantiate the VAR model object from statsmodels
     model = VAR(errors)
     # fit model with determined lag values
@@ -110,61 +200,710 @@ def VAR_prediction(errors: list[list[float]],
     return Y_pred[0]
 
 
+def lagged_regressors(Y: ndarray, lag: int) -> ndarray:
+    """
+    VAR regressors with a constant term: the row for the observation t is
+    [1, y_{t-1}, ..., y_{t-lag}], for t on [lag, len(Y)]. The last row
+    is the one for forecasting the next observation.
+
+    Leading axes of `Y` are kept, so that a stack of series of shape
+    (..., n, k) gives a stack of regressors.
+    """
+    (*batch, n, k) = Y.shape
+    # (..., n - lag + 1, k, lag) view of every window of `lag` observations
+    windows = sliding_window_view(Y, lag, axis=-2)
+    Z = np.ones((*batch, n - lag + 1, 1 + k * lag))
+    Z[..., 1:] = (windows[..., ::-1]
+                  .swapaxes(-1, -2)
+                  .reshape(*batch, n - lag + 1, -1))
+    return Z
+
+
+def numpy_VAR_prediction(errors: ndarray, lag: int = 15) -> ndarray:
+    """
+    One-step forecast of a VAR(lag) model with a constant term, fitted by
+    OLS through a single least-squares solve. Same as the statsmodels
+    forecast on `VAR_prediction`, without its model and results objects.
+    """
+    Y = np.asarray(errors, dtype=float)
+    Z = lagged_regressors(Y, lag)
+    (coefs, *_) = np.linalg.lstsq(Z[:-1], Y[lag:], rcond=None)
+    return Z[-1] @ coefs
+
+
+VAR_LAG_CRITERIA = ('aic', 'bic', 'hqic', 'fpe')
+
+
+def VAR_information_criteria(errors: ndarray,
+                             max_lag: int) -> dict[str, ndarray]:
+    """
+    Information criteria of the VAR(p) models with a constant term for
+    every lag p on [1, max_lag], as on statsmodels `VAR.select_order`.
+    All models are fitted on the same sample, which starts at `max_lag`.
+
+    The regressors of a VAR(p) are the first 1 + k * p columns of the
+    VAR(max_lag) ones, so a single QR decomposition of the regressors and
+    the targets gives the residual covariance of every lag order.
+    Returns a array indexed by p - 1 for each criterion.
+    """
+    Y = np.asarray(errors, dtype=float)
+    (n, k) = Y.shape
+    Z = lagged_regressors(Y, max_lag)[:-1]
+    n_obs = len(Z)
+    n_regressors = Z.shape[1]
+    if n_obs <= n_regressors:
+        raise ValueError(f"{n} errors aren't enough for a VAR({max_lag})")
+
+    R = np.linalg.qr(np.hstack([Z, Y[max_lag:]]), mode='r')
+
+    lags = np.arange(1, max_lag + 1)
+    log_dets = np.empty(max_lag)
+    for (i, lag) in enumerate(lags):
+        # Target components which are orthogonal to the first regressors
+        residuals = R[1 + k * lag:, n_regressors:]
+        sigma = residuals.T @ residuals / n_obs
+        log_dets[i] = np.linalg.slogdet(sigma)[1]
+
+    free_params = lags * k ** 2 + k
+    df_model = k * lags + 1
+    return {'aic': log_dets + 2 / n_obs * free_params,
+            'bic': log_dets + np.log(n_obs) / n_obs * free_params,
+            'hqic': log_dets + 2 * np.log(np.log(n_obs)) / n_obs * free_params,
+            'fpe': (((n_obs + df_model) / (n_obs - df_model)) ** k
+                    * np.exp(log_dets))}
+
+
+def select_var_lag(errors: ndarray,
+                   max_lag: int = 15,
+                   criterion: str = 'aic') -> int:
+    """
+    VAR lag order on [1, max_lag] which minimizes a information criterion.
+    """
+    if criterion not in VAR_LAG_CRITERIA:
+        raise ValueError(f"Unknown lag selection criterion {criterion}")
+    criteria = VAR_information_criteria(errors, max_lag)
+    return int(np.argmin(criteria[criterion])) + 1
+
+
+def VAR_prediction_batch(errors: ndarray, lag: int = 15) -> ndarray:
+    """
+    `numpy_VAR_prediction` over a stack of (n_series, n, k) error series
+    of the same length. The normal equations of every series are built
+    with stacked matrix products and solved by a single batched
+    `np.linalg.solve` call. Returns the (n_series, k) forecasts.
+    """
+    Y = np.asarray(errors, dtype=float)
+    Z = lagged_regressors(Y, lag)
+    X = Z[:, :-1]
+    X_t = X.swapaxes(-1, -2)
+    gram = X_t @ X
+    moments = X_t @ Y[:, lag:]
+    try:
+        coefs = np.linalg.solve(gram, moments)
+    except np.linalg.LinAlgError:
+        # Rank-deficient regressors, eg. on constant errors
+        coefs = np.linalg.pinv(gram) @ moments
+    return (Z[:, -1:] @ coefs)[:, 0]
+
+
+class OnlineVAR():
+    """
+    VAR model with a constant term whose coefficients are updated through
+    recursive least squares, in O((k * lag)^2) per new observation.
+
+    Observations are discounted by `forgetting_factor` per step. If it is 1,
+    the coefficients are the same as refitting OLS on every observation,
+    as `VAR_prediction` does.
+    """
+
+    def __init__(self, lag: int, forgetting_factor: float = 1.0):
+        self.lag = lag
+        self.forgetting_factor = forgetting_factor
+        self.coefs: ndarray = None
+        self.P: ndarray = None
+        # Last `lag` observations, most recent first
+        self.recent: ndarray = None
+
+    def fit(self, Y: ndarray) -> 'OnlineVAR':
+        Y = np.asarray(Y, dtype=float)
+        Z = lagged_regressors(Y, self.lag)[:-1]
+        weights = self.forgetting_factor ** np.arange(len(Z) - 1, -1, -1)
+        weighted_Z = Z * weights[:, None]
+        self.P = np.linalg.pinv(Z.T @ weighted_Z)
+        self.coefs = self.P @ (weighted_Z.T @ Y[self.lag:])
+        self.recent = Y[:-self.lag - 1:-1].copy()
+        return self
+
+    def regressor(self) -> ndarray:
+        return np.concatenate([[1.0], self.recent.ravel()])
+
+    def update(self, y: ndarray) -> None:
+        z = self.regressor()
+        Pz = self.P @ z
+        gain = Pz / (self.forgetting_factor + z @ Pz)
+        self.coefs += np.outer(gain, y - z @ self.coefs)
+        self.P = (self.P - np.outer(gain, Pz)) / self.forgetting_factor
+        self.recent = np.vstack([y, self.recent[:-1]])
+
+    def forecast(self) -> ndarray:
+        return self.regressor() @ self.coefs
+
+    def copy(self) -> 'OnlineVAR':
+        other = OnlineVAR(self.lag, self.forgetting_factor)
+        other.coefs = self.coefs.copy()
+        other.P = self.P.copy()
+        other.recent = self.recent.copy()
+        return other
+
+
+def action_error_array(past_states: list[ActionState],
+                       params: UserActionParams,
+                       ewm_alpha=0.8) -> ndarray:
+    """
+    Errors between the EWM-smoothed and the real actions on the
+    transformed coordinates, as a (len(past_states) - 1, 4) array.
+    """
+    if len(past_states) > 1:
+        token_states = np.array([state.token_state for state in past_states],
+                                dtype=float)
+        pid_states = np.array([state.pid_state for state in past_states],
+                              dtype=float)
+        eth_prices = np.array([state.eth_price for state in past_states],
+                              dtype=float)
+
+        # Real actions and the EWM difference between states
+        real_actions = np.diff(token_states, axis=0)
+        optimal_actions = np.diff(pd.DataFrame(token_states)
+                                  .ewm(alpha=ewm_alpha)
+                                  .mean()
+                                  .to_numpy(),
+                                  axis=0)
+
+        # Transform both with respect to the state after the action
+        transform_args = (token_states[1:],
+                          pid_states[1:],
+                          params,
+                          eth_prices[1:])
+        transformed_real_actions = coordinate_transform_batch(real_actions,
+                                                              *transform_args)
+        transformed_optimal_actions = coordinate_transform_batch(optimal_actions,
+                                                                 *transform_args)
+        return transformed_optimal_actions - transformed_real_actions
+    else:
+        raise Exception("Insufficient data points")
+
+
 def action_errors(past_states: list[ActionState],
                   params: UserActionParams,
                   ewm_alpha=0.8) -> Iterable[TransformedTokenState]:
+    errors = action_error_array(past_states, params, ewm_alpha)
+    for error in errors.tolist():
+        yield TransformedTokenState(*error)
 
-    if len(past_states) > 1:
-        # First state
-        last_token_state: TokenState = past_states[0].token_state
-
-        # Retrieve a dataframe of all past token states
-        token_state_list = [state.token_state
-                            for state in past_states]
-        token_state_df = pd.DataFrame(token_state_list)
-
-        # Compute the EWM difference between states
-        optimal_actions_df = (token_state_df
-                              .ewm(alpha=ewm_alpha)
-                              .mean()
-                              .diff()
-                              .to_dict(orient='records')
-                              [1:])
-        optimal_actions = [TokenState(**row) for row in optimal_actions_df]
-
-        # Iterate
-        for i, state in enumerate(past_states[1:]):
-            token_state = state.token_state
-
-            # Compute real and optimal actions
-            real_action = token_state - last_token_state
-            optimal_action = optimal_actions[i]
-
-            transform_args = (token_state,
-                              state.pid_state,
-                              params,
-                              state.eth_price)
-
-            # Transform real and optimal actions
-            transformed_real_action = coordinate_transform(real_action,
-                                                           *transform_args)
-            transformed_optimal_action = coordinate_transform(optimal_action,
-                                                              *transform_args)
 
-            # Compute error
-            error = transformed_optimal_action - transformed_real_action
-            last_token_state = token_state
+@dataclass(frozen=True)
+class ActionErrorPrefix():
+    """
+    Transformed action errors and EWM state over the backtesting action
+    states, computed once and shared read-only by every extrapolation run.
+
+    If `errors_path` is given, the errors are memory-mapped from that
+    `.npy` file, and pickling only sends the path, so that worker
+    processes share the file pages rather than receiving a copy.
+    """
+    params: UserActionParams
+    ewm_alpha: float
+    n_states: int
+    last_token_state: TokenState
+    last_ewm_mean: ndarray
+    errors: ndarray
+    errors_path: str = None
+
+    @classmethod
+    def from_states(cls,
+                    states: list[ActionState],
+                    params: UserActionParams,
+                    ewm_alpha: float = 0.8,
+                    errors_path: str = None) -> 'ActionErrorPrefix':
+        token_states = np.array([state.token_state for state in states],
+                                dtype=float)
+        last_ewm_mean = (pd.DataFrame(token_states)
+                         .ewm(alpha=ewm_alpha)
+                         .mean()
+                         .to_numpy()[-1])
+        errors = action_error_array(states, params, ewm_alpha)
+        if errors_path is not None:
+            np.save(errors_path, errors)
+            errors = np.load(errors_path, mmap_mode='r')
+        else:
+            errors.setflags(write=False)
+        return cls(params,
+                   ewm_alpha,
+                   len(states),
+                   states[-1].token_state,
+                   last_ewm_mean,
+                   errors,
+                   errors_path)
+
+    def matches(self,
+                states: list[ActionState],
+                params: UserActionParams,
+                ewm_alpha: float) -> bool:
+        return (self.errors is not None
+                and self.params == params
+                and self.ewm_alpha == ewm_alpha
+                and self.n_states == len(states)
+                and self.last_token_state == states[-1].token_state)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.errors_path is not None:
+            del state['errors']
+        return state
+
+    def __setstate__(self, state):
+        if 'errors' not in state:
+            try:
+                state['errors'] = np.load(state['errors_path'], mmap_mode='r')
+            except FileNotFoundError:
+                # The run which created the file is over, so the prefix
+                # won't match and the errors are computed from the states
+                state['errors'] = None
+        self.__dict__.update(state)
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class ActionErrorBuffer():
+    """
+    Transformed action errors of a growing sequence of action states, as
+    on `action_error_array`. Every appended state only costs the newest
+    error, since the running EWM is kept rather than recomputed.
 
-            # Yield
-            yield error
-    else:
-        raise Exception("Insufficient data points")
+    If a `window` is given, only the errors for the last `window` states
+    are kept, on a fixed-size ring buffer. Otherwise, the buffer grows.
+    """
+
+    def __init__(self,
+                 params: UserActionParams,
+                 ewm_alpha: float = 0.8,
+                 capacity: int = 1024,
+                 window: int = None):
+        self.params = params
+        self.ewm_alpha = ewm_alpha
+        self.window = window
+        self.size = 0
+        # Number and last token state of the states the buffer started with
+        self.prefix: tuple[int, tuple] = (0, None)
+        # Shared errors for the first states, which aren't on the rows
+        self.shared_prefix: ActionErrorPrefix = None
+        # First state on the rows
+        self.start = 0
+        if window is not None:
+            # Keep one more row for discarding the last state
+            capacity = window + 2
+        self.allocate(capacity)
+
+    def allocate(self, capacity: int) -> None:
+        """
+        Every row is stored both at `i % capacity` and `i % capacity +
+        capacity`, so that the last `capacity` rows are always contiguous.
+        """
+        self.capacity = capacity
+        self.token_states = np.empty((2 * capacity, 4))
+        self.ewm_means = np.empty((2 * capacity, 4))
+        # The error on row i is for the action between the states i - 1 and i
+        self.error_rows = np.empty((2 * capacity, 4))
+
+    @classmethod
+    def from_states(cls,
+                    states: list[ActionState],
+                    params: UserActionParams,
+                    ewm_alpha: float = 0.8,
+                    window: int = None) -> 'ActionErrorBuffer':
+        buffer = cls(params, ewm_alpha, max(2 * len(states), 16), window)
+        buffer.extend(states)
+        if len(states) > 0:
+            buffer.prefix = (len(states), states[-1].token_state)
+        return buffer
+
+    @classmethod
+    def from_prefix(cls,
+                    prefix: ActionErrorPrefix,
+                    window: int = None,
+                    capacity: int = 1024) -> 'ActionErrorBuffer':
+        """
+        Buffer which continues the states of a shared prefix, without
+        copying its errors.
+        """
+        buffer = cls(prefix.params, prefix.ewm_alpha, capacity, window)
+        buffer.shared_prefix = prefix
+        buffer.prefix = (prefix.n_states, prefix.last_token_state)
+        i = prefix.n_states - 1
+        buffer.start = i
+        buffer.write('token_states', i, np.array(prefix.last_token_state))
+        buffer.write('ewm_means', i, prefix.last_ewm_mean)
+        buffer.write('error_rows', i, np.full(4, np.nan))
+        buffer.size = prefix.n_states
+        return buffer
+
+    @property
+    def n_errors(self) -> int:
+        return max(self.size - 1, 0)
+
+    @property
+    def errors(self) -> ndarray:
+        """
+        The last errors, up to `window` of them.
+        """
+        n = self.n_errors if self.window is None else min(self.n_errors,
+                                                          self.window)
+        start = self.size - n
+        if start > self.start:
+            return self.rows(self.error_rows, start, self.size)
+        else:
+            # The error for state i is on the row i - 1 of the prefix errors
+            shared_errors = self.shared_prefix.errors[start - 1:self.start]
+            own_errors = self.rows(self.error_rows, self.start + 1, self.size)
+            return np.concatenate([shared_errors, own_errors])
+
+    def rows(self, array: ndarray, start: int, end: int) -> ndarray:
+        """
+        View of the rows for the states [start, end).
+        """
+        j = (end - 1) % self.capacity + self.capacity + 1
+        return array[j - (end - start):j]
+
+    def token_state_at(self, i: int) -> Union[ndarray, None]:
+        if max(self.size - self.capacity, self.start) <= i < self.size:
+            return self.token_states[i % self.capacity]
+        else:
+            return None
+
+    def grow(self) -> None:
+        n = min(self.size - self.start, self.capacity)
+        arrays = [self.rows(array, self.size - n, self.size)
+                  for array in (self.token_states, self.ewm_means, self.error_rows)]
+        self.allocate(2 * self.capacity)
+        for (name, rows) in zip(('token_states', 'ewm_means', 'error_rows'), arrays):
+            for i in range(self.size - n, self.size):
+                self.write(name, i, rows[i - self.size + n])
+
+    def write(self, name: str, i: int, row: ndarray) -> None:
+        array = getattr(self, name)
+        j = i % self.capacity
+        array[j] = row
+        array[j + self.capacity] = row
+
+    def truncate(self, size: int) -> bool:
+        """
+        Discard the states from `size` onwards. Returns False if the
+        previous states aren't on the buffer anymore, on which case
+        nothing is done.
+        """
+        # Rows which can be discarded while keeping a full window
+        discardable = self.capacity - (self.window or 1)
+        if size >= self.size:
+            return True
+        elif size == 0 and self.start == 0:
+            self.size = size
+            return True
+        elif size > self.start and self.size - size <= discardable:
+            self.size = size
+            return True
+        else:
+            return False
+
+    def append(self, state: ActionState) -> None:
+        if self.window is None and self.size - self.start + 1 > self.capacity:
+            self.grow()
+        i = self.size
+        x = np.array(state.token_state, dtype=float)
+        self.write('token_states', i, x)
+
+        if i == 0:
+            self.write('ewm_means', i, x)
+            self.write('error_rows', i, np.full(4, np.nan))
+        else:
+            last_x = self.token_states[(i - 1) % self.capacity]
+            last_mean = self.ewm_means[(i - 1) % self.capacity]
+
+            # Adjusted EWM, as on `pd.DataFrame.ewm(alpha=ewm_alpha)`:
+            # the weights sum over i observations is (1 - decay^i) / alpha
+            decay = 1 - self.ewm_alpha
+            weights = (1 - decay ** i) / self.ewm_alpha
+            mean = (x + decay * last_mean * weights) / (1 + decay * weights)
+            self.write('ewm_means', i, mean)
+
+            actions = np.stack([mean - last_mean, x - last_x])
+            transformed_actions = coordinate_transform_batch(actions,
+                                                             x,
+                                                             state.pid_state,
+                                                             self.params,
+                                                             state.eth_price)
+            self.write('error_rows', i,
+                       transformed_actions[0] - transformed_actions[1])
+        self.size += 1
+
+    def extend(self, states: Iterable[ActionState]) -> None:
+        for state in states:
+            self.append(state)
+
+
+def transformed_drift(transformed_errors: ndarray) -> float:
+    """
+    Largest deviation of the columns mean from 0 or std from 1 on errors
+    transformed by a standardizing `PowerTransformer`.
+    """
+    means = np.abs(transformed_errors.mean(axis=0))
+    stds = np.abs(transformed_errors.std(axis=0) - 1)
+    return float(max(means.max(), stds.max()))
+
+
+class PowerTransformerCache():
+    """
+    `PowerTransformer` over a growing error sequence, which is refitted only
+    once every `refit_interval` new errors, or when the errors transformed
+    by the last fit have a `transformed_drift` over `refit_drift`. Between
+    refits, the fitted lambdas are only applied.
+    """
+
+    def __init__(self,
+                 refit_interval: int = 1,
+                 refit_drift: float = None):
+        self.refit_interval = refit_interval
+        self.refit_drift = refit_drift
+        self.transformer: PowerTransformer = None
+        self.n_fitted = 0
+
+    def refit(self, errors: ndarray, n_total: int) -> ndarray:
+        self.transformer = PowerTransformer()
+        self.n_fitted = n_total
+        return self.transformer.fit_transform(errors)
+
+    def fit_transform(self,
+                      errors: ndarray,
+                      n_total: int = None) -> ndarray:
+        """
+        Transform the errors, refitting if due. `n_total` is the number of
+        errors seen so far, if `errors` only holds the last ones.
+        """
+        n_total = len(errors) if n_total is None else n_total
+        if self.is_refit_due(n_total):
+            return self.refit(errors, n_total)
+        transformed_errors = self.transformer.transform(errors)
+        if self.has_drifted(transformed_errors):
+            return self.refit(errors, n_total)
+        return transformed_errors
+
+    def is_refit_due(self, n_total: int) -> bool:
+        n_new = n_total - self.n_fitted
+        return (self.transformer is None
+                or n_new < 0
+                or n_new >= self.refit_interval)
+
+    def has_drifted(self, transformed_errors: ndarray) -> bool:
+        return (self.refit_drift is not None
+                and transformed_drift(transformed_errors) > self.refit_drift)
+
+
+def transformed_prediction_to_action(transformed_prediction: ndarray,
+                                     transformer: PowerTransformer,
+                                     state: ActionState,
+                                     action_params: UserActionParams) -> TokenState:
+    transformed_prediction = transformed_prediction.reshape(1, -1)
+
+    # Go back to the transformed coordinates
+    prediction = transformer.inverse_transform(transformed_prediction)
+    prediction = prediction.tolist()[0] # HACK for making sense of numpy
+    transformed_new_action = TransformedTokenState(*prediction)
+
+    # Go back to the original coordinates
+    transform_args = (state.token_state,
+                      state.pid_state,
+                      action_params,
+                      state.eth_price)
+    new_action = reverse_coordinate_transform(transformed_new_action,
+                                              *transform_args)
+    return new_action
+
+
+def predict_action(errors: ndarray,
+                   state: ActionState,
+                   action_params: UserActionParams,
+                   var_lag: int = 15,
+                   var_backend: str = 'statsmodels',
+                   transformer_cache: PowerTransformerCache = None,
+                   n_total: int = None,
+                   lag_criterion: str = None) -> TokenState:
+    """
+    Fit a VAR model on the power-transformed errors and map its one-step
+    prediction into a action on the original coordinates. The power
+    transformer is refitted on every call unless a cache is given.
+
+    If a `lag_criterion` is given, `var_lag` is the maximum lag order and
+    the one to be used is chosen through `select_var_lag`.
+    """
+    # Perform a Power Transformation
+    if transformer_cache is None:
+        transformer_cache = PowerTransformerCache()
+    transformed_errors = transformer_cache.fit_transform(errors, n_total)
+    transformer = transformer_cache.transformer
+
+    if lag_criterion is not None:
+        var_lag = select_var_lag(transformed_errors, var_lag, lag_criterion)
+
+    # Train VAR model and generate prediction
+    transformed_prediction = VAR_prediction(transformed_errors,
+                                            var_lag,
+                                            var_backend)
+    return transformed_prediction_to_action(transformed_prediction,
+                                            transformer,
+                                            state,
+                                            action_params)
+
+
+class OnlineActionPredictor():
+    """
+    Counterpart of `predict_action` for a growing error sequence. The power
+    transformer is refitted with the same policy as `PowerTransformerCache`,
+    and the VAR model is a `OnlineVAR` which is updated with each new error
+    in between refits and fitted again on every refit. If a `lag_criterion`
+    is given, the lag order is selected along with the transformer, with
+    `var_lag` as the maximum. Non-finite forecasts fall back to no action.
+    """
+
+    def __init__(self,
+                 var_lag: int = 15,
+                 forgetting_factor: float = 1.0,
+                 lag_criterion: str = None,
+                 refit_interval: int = 1,
+                 refit_drift: float = None):
+        self.var_lag = var_lag
+        self.forgetting_factor = forgetting_factor
+        self.lag_criterion = lag_criterion
+        self.transformer_cache = PowerTransformerCache(refit_interval,
+                                                       refit_drift)
+        self.var: OnlineVAR = None
+        self.n_fitted = 0
+
+    @property
+    def transformer(self) -> PowerTransformer:
+        return self.transformer_cache.transformer
+
+    def predict(self,
+                errors: ndarray,
+                n_committed: int,
+                state: ActionState,
+                action_params: UserActionParams,
+                offset: int = 0) -> TokenState:
+        """
+        Predict the next action. `errors` are the errors from the `offset`
+        one onwards. Only the errors before `n_committed` are added to the
+        model, while the remaining ones are used for this prediction only.
+        """
+        committed_errors = errors[:n_committed - offset]
+        first_new = self.n_fitted - offset
+        cache = self.transformer_cache
+        refit = (self.var is None
+                 or first_new < 0
+                 or n_committed < self.n_fitted
+                 or cache.is_refit_due(n_committed))
+        if not refit and cache.refit_drift is not None:
+            refit = cache.has_drifted(cache.transformer.transform(committed_errors))
+        if refit:
+            transformed_errors = cache.refit(committed_errors, n_committed)
+            lag = self.var_lag
+            if self.lag_criterion is not None:
+                lag = select_var_lag(transformed_errors, lag, self.lag_criterion)
+            self.var = OnlineVAR(lag,
+                                 self.forgetting_factor).fit(transformed_errors)
+        else:
+            new_errors = errors[first_new:n_committed - offset]
+            for error in self.transformer.transform(new_errors):
+                self.var.update(error)
+        self.n_fitted = n_committed
+
+        var = self.var
+        if len(errors) > n_committed - offset:
+            var = var.copy()
+            for error in self.transformer.transform(errors[n_committed - offset:]):
+                var.update(error)
+
+        forecast = var.forecast()
+        if not np.all(np.isfinite(forecast)):
+            return TokenState(0.0, 0.0, 0.0, 0.0)
+        action = transformed_prediction_to_action(forecast,
+                                                  self.transformer,
+                                                  state,
+                                                  action_params)
+        if not np.all(np.isfinite(tuple(action))):
+            return TokenState(0.0, 0.0, 0.0, 0.0)
+        return action
+
+
+def predict_action_batch(errors: ndarray,
+                         states: list[ActionState],
+                         action_params: UserActionParams,
+                         var_lag: int = 15,
+                         transformers: list[PowerTransformer] = None) -> ndarray:
+    """
+    `predict_action` with the numpy backend over a stack of (n_series, n, k)
+    error series of the same length, eg. the runs of a Monte Carlo
+    extrapolation at the same timestep. The VAR models are fitted by
+    `VAR_prediction_batch` and the predictions are mapped back to the
+    original coordinates at once. Returns the actions as a
+    (n_series, 4) array with the `TokenState` fields.
+
+    The power transformers are refitted per series unless fitted
+    ones are given.
+    """
+    errors = np.asarray(errors, dtype=float)
+    if transformers is None:
+        transformers = [PowerTransformer().fit(series) for series in errors]
+    transformed_errors = np.stack([transformer.transform(series)
+                                   for (transformer, series)
+                                   in zip(transformers, errors)])
+
+    # Train all VAR models and generate predictions
+    transformed_predictions = VAR_prediction_batch(transformed_errors, var_lag)
+
+    # Go back to the transformed coordinates
+    predictions = np.concatenate([transformer.inverse_transform(prediction.reshape(1, -1))
+                                  for (transformer, prediction)
+                                  in zip(transformers, transformed_predictions)])
+
+    # Go back to the original coordinates
+    return reverse_coordinate_transform_batch(predictions,
+                                              [state.token_state for state in states],
+                                              [state.pid_state for state in states],
+                                              action_params,
+                                              [state.eth_price for state in states])
+
+
+def fit_predict_action_batch(past_states: list[list[ActionState]],
+                             action_params: UserActionParams,
+                             ewm_alpha: float = 0.8,
+                             var_lag: int = 15) -> list[TokenState]:
+    """
+    `fit_predict_action` over several action state histories of the same
+    length, with a single batched VAR solve for all of them.
+    """
+    errors = np.stack([action_error_array(states, action_params, ewm_alpha)
+                       for states in past_states])
+    actions = predict_action_batch(errors,
+                                   [states[-1] for states in past_states],
+                                   action_params,
+                                   var_lag)
+    return [TokenState(*action) for action in actions.tolist()]
 
 
 def fit_predict_action(past_states: list[ActionState],
                        action_params: UserActionParams,
                        ewm_alpha: float = 0.8,
-                       var_lag: int = 15) -> Union[TokenState, None]:
+                       var_lag: int = 15,
+                       var_backend: str = 'statsmodels') -> Union[TokenState, None]:
     """
     Steps:
     1. Retrieve historical arbitrageur actions
@@ -176,37 +915,15 @@ def fit_predict_action(past_states: list[ActionState],
     """
     if type(past_states) == list:
         if len(past_states) > 0:
-            state = past_states[-1]
-
             # Retrieve errors on the transformed coordinates
-            errors = list(action_errors(past_states,
+            errors = action_error_array(past_states,
                                         action_params,
-                                        ewm_alpha=ewm_alpha))
-            errors = pd.DataFrame(errors).values
-
-            # Perform a Power Transformation
-            transformer = PowerTransformer()
-            transformed_errors = transformer.fit_transform(errors)
-
-            # Train VAR model and generate prediction
-            transformed_prediction = VAR_prediction(transformed_errors,
-                                                    var_lag)
-            
-            transformed_prediction = transformed_prediction.reshape(1, -1)
-            
-            # Go back to the transformed coordinates
-            prediction = transformer.inverse_transform(transformed_prediction)
-            prediction = prediction.tolist()[0] # HACK for making sense of numpy
-            transformed_new_action = TransformedTokenState(*prediction)
-
-            # Go back to the original coordinates
-            transform_args = (state.token_state,
-                              state.pid_state,
-                              action_params,
-                              state.eth_price)
-            new_action = reverse_coordinate_transform(transformed_new_action,
-                                                      *transform_args)
-            return new_action
+                                        ewm_alpha=ewm_alpha)
+            return predict_action(errors,
+                                  past_states[-1],
+                                  action_params,
+                                  var_lag,
+                                  var_backend)
         else:
             return None
     else:
@@ -0,0 +1,88 @@
+import pandas as pd
+from pytest import approx
+
+from rai_digital_twin.artifacts import *
+from rai_digital_twin.prepare_data import load_array_backtesting_data, load_backtesting_data
+from rai_digital_twin.prepare_data import iter_backtesting_data, timestep_frame
+
+
+def test_artifact_roundtrip(tmp_path):
+    """
+    Make sure that every artifact format keeps the historical data, and
+    that the backtesting data loaded from each of them is the same.
+    """
+    csv_path = find_last_artifact('data/runs', 'retrieval')
+    df = read_artifact(csv_path)
+    expected = load_backtesting_data(csv_path)
+
+    for fmt in ARTIFACT_SUFFIXES.keys():
+        path = artifact_path(tmp_path, 'test_retrieval', fmt)
+        write_artifact(df, path)
+        assert artifact_format(path) == fmt
+
+        loaded_df = read_artifact(path, memory_map=True)
+        assert list(loaded_df.columns) == list(df.columns)
+        assert loaded_df.debt.values == approx(df.debt.values)
+
+        backtesting_data = load_backtesting_data(path)
+        assert backtesting_data.heights == expected.heights
+        token_states = pd.DataFrame(backtesting_data.token_states.values())
+        expected_token_states = pd.DataFrame(expected.token_states.values())
+        assert token_states.values == approx(expected_token_states.values)
+
+    assert find_last_artifact(tmp_path, 'retrieval').name.startswith('test_retrieval')
+
+
+def test_array_backtesting_data():
+    """
+    Make sure that the columnar backtesting data is equivalent to the
+    dict-based one.
+    """
+    path = find_last_artifact('data/runs', 'retrieval')
+    expected = load_backtesting_data(path)
+    backtesting_data = load_array_backtesting_data(path)
+
+    assert backtesting_data.heights == expected.heights
+    assert backtesting_data.heights.get(-1, 0) == 0
+    assert len(backtesting_data.token_states) == len(expected.token_states)
+    for t in (0, len(expected.heights) - 1):
+        assert backtesting_data.token_states[t] == approx(expected.token_states[t])
+        assert backtesting_data.exogenous_data[t]['eth_price'] == approx(expected.exogenous_data[t]['eth_price'])
+        assert backtesting_data.pid_states[t].redemption_price == approx(expected.pid_states[t].redemption_price)
+
+    pid_df = timestep_frame(backtesting_data.pid_states)
+    expected_pid_df = timestep_frame(expected.pid_states)
+    assert list(pid_df.columns) == list(expected_pid_df.columns)
+    assert pid_df.redemption_rate.values == approx(expected_pid_df.redemption_rate.values)
+
+
+def test_chunked_backtesting_data(tmp_path):
+    """
+    Make sure that the streamed backtesting data is the same as loading
+    it at once, and that the range filters are applied.
+    """
+    csv_path = find_last_artifact('data/runs', 'retrieval')
+    df = read_artifact(csv_path).sort_values('block_number')
+    expected = load_array_backtesting_data(csv_path)
+
+    for fmt in ARTIFACT_SUFFIXES.keys():
+        path = artifact_path(tmp_path, 'test_retrieval', fmt)
+        write_artifact(df, path)
+
+        chunks = list(iter_backtesting_data(path, chunksize=25))
+        assert len(chunks) > 1
+        heights = {t: h for chunk in chunks for (t, h) in chunk.heights.items()}
+        assert heights == expected.heights
+        last = chunks[-1]
+        assert last.token_states[len(heights) - 1] == approx(expected.token_states[len(heights) - 1])
+
+        block_range = (df.block_number.iloc[10], df.block_number.iloc[50])
+        chunks = list(iter_backtesting_data(path, 25, block_range=block_range))
+        heights = [h for chunk in chunks for h in chunk.heights.values()]
+        assert heights == list(df.block_number.iloc[10:50])
+
+        timestamp_range = (df.timestamp.iloc[20], df.timestamp.iloc[30])
+        chunks = list(iter_backtesting_data(path, 25, timestamp_range=timestamp_range))
+        heights = [h for chunk in chunks for h in chunk.heights.values()]
+        assert heights == list(df.block_number.iloc[20:30])
+        assert list(chunks[0].heights.keys())[0] == 0
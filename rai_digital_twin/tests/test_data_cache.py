@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+from rai_digital_twin.data_cache import *
+
+
+def test_missing_intervals():
+    coverage = [(10, 20), (30, 40)]
+    assert missing_intervals(coverage, (0, 50)) == [(0, 10), (20, 30), (40, 50)]
+    assert missing_intervals(coverage, (12, 18)) == []
+    assert missing_intervals(coverage, (15, 35)) == [(20, 30)]
+    assert missing_intervals([], (0, 5)) == [(0, 5)]
+
+    assert merge_intervals([(30, 40), (10, 20), (20, 25)]) == [(10, 25), (30, 40)]
+
+
+def test_block_cache_roundtrip(tmp_path):
+    cache = load_block_cache(tmp_path / 'cache')
+    assert len(cache.system_states) == 0
+    assert cache.hourly_stats_coverage == []
+
+    old = pd.DataFrame({'globalDebt': [1.0, 2.0]},
+                       index=pd.Index([10, 20], name='block_number'))
+    new = pd.DataFrame({'globalDebt': [3.0, 4.0]},
+                       index=pd.Index([20, 30], name='block_number'))
+    cache.system_states = upsert_blocks(old, new)
+    cache.hourly_stats_coverage = [(0, 3600)]
+    save_block_cache(cache)
+
+    loaded = load_block_cache(tmp_path / 'cache')
+    assert list(loaded.system_states.index) == [10, 20, 30]
+    assert list(loaded.system_states.globalDebt) == [1.0, 3.0, 4.0]
+    assert loaded.hourly_stats_coverage == [(0, 3600)]
+
+
+def test_block_checkpoint(tmp_path):
+    """
+    Make sure that checkpointed heights survive an interrupted retrieval.
+    """
+    cache = load_block_cache(tmp_path)
+    for block_number in (10, 20):
+        index = pd.Index([block_number], name='block_number')
+        append_block_checkpoint(cache,
+                                pd.DataFrame({'globalDebt': [1.0]}, index=index),
+                                pd.DataFrame({'debt': [2.0]}, index=index))
+
+    resumed = load_block_cache(tmp_path)
+    assert list(resumed.system_states.index) == [10, 20]
+    assert list(resumed.safe_history.debt) == [2.0, 2.0]
+
+    save_block_cache(resumed)
+    assert not (tmp_path / SYSTEM_STATES_CHECKPOINT_FILE).exists()
+    assert list(load_block_cache(tmp_path).safe_history.index) == [10, 20]
+
+
+def test_partial_checkpoint_row(tmp_path):
+    """
+    Make sure that only a partially written row is dropped from a
+    checkpoint, while rows with null values are kept.
+    """
+    cache = load_block_cache(tmp_path)
+    for (block_number, value) in ((10, 1.0), (20, np.nan), (30, 3.0)):
+        index = pd.Index([block_number], name='block_number')
+        append_block_checkpoint(cache,
+                                pd.DataFrame({'globalDebt': [value],
+                                              'systemSurplus': [2.0]},
+                                             index=index),
+                                pd.DataFrame({'debt': [value]}, index=index))
+
+    # Interrupt the retrieval while writing the last row
+    path = tmp_path / SYSTEM_STATES_CHECKPOINT_FILE
+    content = path.read_text()
+    path.write_text(content[:content.rindex(',')])
+
+    resumed = load_block_cache(tmp_path)
+    assert list(resumed.system_states.index) == [10, 20]
+    assert np.isnan(resumed.system_states.globalDebt[20])
+    assert list(resumed.safe_history.index) == [10, 20, 30]
+    assert np.isnan(resumed.safe_history.debt[20])
+    assert 'checkpoint_complete' not in resumed.safe_history.columns
+
+
+def test_append_after_partial_checkpoint_row(tmp_path):
+    """
+    Make sure that the rows appended after a partially written one are
+    kept, rather than glued onto it.
+    """
+    def append_block(cache, block_number):
+        index = pd.Index([block_number], name='block_number')
+        append_block_checkpoint(cache,
+                                pd.DataFrame({'globalDebt': [float(block_number)],
+                                              'systemSurplus': [2.0]},
+                                             index=index),
+                                pd.DataFrame({'debt': [1.0]}, index=index))
+
+    cache = load_block_cache(tmp_path)
+    for block_number in (1, 2):
+        append_block(cache, block_number)
+
+    # Interrupt the retrieval while writing the third row
+    path = tmp_path / SYSTEM_STATES_CHECKPOINT_FILE
+    path.write_text(path.read_text() + '3,5.0')
+
+    resumed = load_block_cache(tmp_path)
+    for block_number in (4, 5):
+        append_block(resumed, block_number)
+
+    resumed = load_block_cache(tmp_path)
+    assert list(resumed.system_states.index) == [1, 2, 4, 5]
+    assert list(resumed.system_states.globalDebt) == [1.0, 2.0, 4.0, 5.0]
+    assert list(resumed.safe_history.index) == [1, 2, 4, 5]
+
+
+def test_append_after_partial_checkpoint_header(tmp_path):
+    """
+    Make sure that a checkpoint which was interrupted while writing its
+    header gets a new one.
+    """
+    cache = load_block_cache(tmp_path)
+    path = tmp_path / SYSTEM_STATES_CHECKPOINT_FILE
+    tmp_path.mkdir(exist_ok=True)
+    path.write_text('block_num')
+    index = pd.Index([7], name='block_number')
+    append_block_checkpoint(cache,
+                            pd.DataFrame({'globalDebt': [7.0]}, index=index),
+                            pd.DataFrame({'debt': [1.0]}, index=index))
+    resumed = load_block_cache(tmp_path)
+    assert list(resumed.system_states.index) == [7]
+    assert list(resumed.system_states.globalDebt) == [7.0]
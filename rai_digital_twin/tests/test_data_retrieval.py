@@ -1,5 +1,96 @@
+import json
+import re
+from random import random
+from time import sleep
+
+from pytest import approx, raises
 
 from rai_digital_twin.prepare_data import *
+from rai_digital_twin.retrieve_data import fetch_concurrently, query_blocks
+from rai_digital_twin.retrieve_data import aggregate_safes, yield_hourly_stats
+from rai_digital_twin.retrieve_data import AdaptiveRateLimiter, post_query
+from rai_digital_twin.retrieve_data import download_data, retrieve_safe_history
+from rai_digital_twin.subgraph_stand_in import SubgraphStandIn, find_last_fixture
+from rai_digital_twin.subgraph_stand_in import UNLOCKED_COLLATERAL_SHARE, load_fixture, running_stand_in
+import rai_digital_twin.retrieve_data as retrieve_data
+
+
+class FakeResponse():
+    def __init__(self, data: dict, status_code: int = 200):
+        self.content = json.dumps({'data': data})
+        self.status_code = status_code
+        self.headers: dict = {}
+
+
+class FlakySession():
+    """
+    Throttles the first requests and then answers a fixed payload.
+    """
+    def __init__(self, throttled_requests: int):
+        self.throttled_requests = throttled_requests
+        self.requests = 0
+        self.rate_limiter = AdaptiveRateLimiter()
+
+    def post(self, url, json=None):
+        self.requests += 1
+        if self.requests <= self.throttled_requests:
+            return FakeResponse(None, status_code=429)
+        else:
+            return FakeResponse({'value': 1})
+
+
+class FakeSession():
+    """
+    Answers aliased block queries with the block number on each field.
+    """
+    def __init__(self):
+        self.requests = 0
+
+    def post(self, url, json=None):
+        self.requests += 1
+        aliases = re.findall(r'(\w+)_(\d+):', json['query'])
+        data = {f'{field}_{block}': {'block': int(block)}
+                for (field, block) in aliases}
+        return FakeResponse(data)
+
+
+class FakeHourlyStatsSession():
+    """
+    Serves hourly stats by honoring the first / timestamp_gt / timestamp_lt
+    arguments.
+    """
+    def __init__(self, timestamps: list[int]):
+        self.timestamps = timestamps
+        self.requests = 0
+
+    def post(self, url, json=None):
+        self.requests += 1
+        query = json['query']
+        first = int(re.search(r'first: (\d+)', query).group(1))
+        lower = int(re.search(r'timestamp_gt: "(-?\d+)"', query).group(1))
+        upper = re.search(r'timestamp_lt: "(\d+)"', query)
+        upper = int(upper.group(1)) if upper is not None else float('inf')
+        rows = [{'timestamp': str(t), 'blockNumber': str(t)}
+                for t in self.timestamps
+                if lower < t < upper][:first]
+        return FakeResponse({'hourlyStats': rows})
+
+
+class FakeSafesSession():
+    """
+    Serves SAFEs by honoring the first / id_gt arguments.
+    """
+    def __init__(self, safes: list[dict]):
+        self.safes = sorted(safes, key=lambda safe: safe['id'])
+        self.requests = 0
+
+    def post(self, url, json=None):
+        self.requests += 1
+        query = json['query']
+        first = int(re.search(r'first: (\d+)', query).group(1))
+        cursor = re.search(r'id_gt: "(\w*)"', query).group(1)
+        rows = [safe for safe in self.safes if safe['id'] > cursor][:first]
+        return FakeResponse({'safes': rows})
 
 def test_retrieval():
     # N = 2
@@ -18,4 +109,154 @@ def test_retrieval():
     # df = download_data(N)
     # assert len(df) <= N
 
-    assert True
\ No newline at end of file
+    assert True
+
+
+def test_fetch_concurrently_order():
+    """
+    Make sure that concurrently fetched results keep the input order.
+    """
+    def fetch(x):
+        sleep(random() / 100)
+        return x * 2
+
+    items = list(range(50))
+    results = fetch_concurrently(fetch, items, max_workers=8)
+    assert results == [x * 2 for x in items]
+
+
+def test_query_blocks_batching():
+    """
+    Make sure that batched queries are split back into per-block records.
+    """
+    session = FakeSession()
+    block_numbers = list(range(100, 160))
+    records = query_blocks(block_numbers,
+                           ('system_state', 'collateral_totals'),
+                           session,
+                           max_workers=4,
+                           blocks_per_query=25)
+
+    assert session.requests == 3
+    assert [record['block_number'] for record in records] == block_numbers
+    for record in records:
+        assert record['system_state']['block'] == record['block_number']
+        assert record['collateral_totals']['block'] == record['block_number']
+
+
+def test_hourly_stats_pagination():
+    """
+    Make sure that the hourly stats feed is filtered by date and that
+    keyset pagination neither skips nor repeats rows.
+    """
+    timestamps = list(range(0, 3600 * 100, 3600))
+    session = FakeHourlyStatsSession(timestamps)
+    date_range = (pd.Timestamp(3600 * 10, unit='s'),
+                  pd.Timestamp(3600 * 50, unit='s'))
+    pages = list(yield_hourly_stats(feed_size=7,
+                                    session=session,
+                                    date_range=date_range))
+    rows = [int(row['timestamp']) for page in pages for row in page]
+    assert rows == timestamps[10:50]
+    assert session.requests == 6
+
+    session = FakeHourlyStatsSession(timestamps)
+    pages = list(yield_hourly_stats(feed_size=10, session=session))
+    rows = [int(row['timestamp']) for page in pages for row in page]
+    assert rows == timestamps
+
+
+def test_aggregate_safes():
+    """
+    Make sure that SAFE totals go past a single page.
+    """
+    safes = [{'id': f'{i:04d}', 'collateral': '1.5', 'debt': str(i)}
+             for i in range(250)]
+    session = FakeSafesSession(safes)
+    totals = aggregate_safes(session, 100, page_size=100)
+    assert session.requests == 3
+    assert totals['collateral'] == approx(1.5 * 250)
+    assert totals['debt'] == approx(sum(range(250)))
+
+
+def test_safe_totals_agree():
+    """
+    Make sure that the system-wide totals are the same as summing the
+    SAFEs on the stand-in subgraph, and that they only count the
+    collateral which is locked on SAFEs.
+    """
+    fixture = load_fixture(find_last_fixture())
+    block_numbers = list(fixture.index[-5:])
+    stand_in = SubgraphStandIn(fixture, safes_per_block=120)
+    with running_stand_in(stand_in) as url:
+        from_totals = retrieve_safe_history(block_numbers,
+                                            max_workers=2,
+                                            use_system_totals=True,
+                                            subgraph_url=url)
+        from_safes = retrieve_safe_history(block_numbers,
+                                           max_workers=2,
+                                           use_system_totals=False,
+                                           subgraph_url=url)
+    assert list(from_totals.index) == block_numbers
+    assert from_totals.collateral.values == approx(from_safes.collateral.values)
+    assert from_totals.debt.values == approx(from_safes.debt.values)
+    assert from_totals.debt.values == approx(fixture.debt.values[-5:])
+    locked_collateral = fixture.collateral.values[-5:]
+    assert from_totals.collateral.values == approx(locked_collateral)
+    assert (from_totals.collateral.values
+            != approx(locked_collateral * (1 + UNLOCKED_COLLATERAL_SHARE)))
+
+
+def test_post_query_backoff(monkeypatch):
+    """
+    Make sure that throttled queries are retried and slow down the session.
+    """
+    monkeypatch.setattr(retrieve_data, 'BACKOFF_BASE', 0.001)
+    session = FlakySession(throttled_requests=3)
+    assert post_query(session, '{}') == {'value': 1}
+    assert session.requests == 4
+    assert session.rate_limiter.delay > 0.0
+
+    session = FlakySession(throttled_requests=10)
+    with raises(Exception):
+        post_query(session, '{}', max_retries=2)
+    assert session.requests == 3
+
+
+def test_download_from_stand_in(tmp_path, monkeypatch):
+    """
+    Make sure that the downloaded data reproduces the recorded fixture,
+    regardless of the SAFE aggregation, throttling and caching.
+    """
+    monkeypatch.setattr(retrieve_data, 'BACKOFF_BASE', 0.001)
+    fixture = load_fixture(find_last_fixture())
+    end = fixture.timestamp.max() + pd.Timedelta(seconds=1)
+    date_range = (end - pd.Timedelta(hours=48), end)
+    expected = fixture[fixture.timestamp >= date_range[0]]
+
+    stand_in = SubgraphStandIn(fixture, safes_per_block=120)
+    with running_stand_in(stand_in, error_rate=0.1) as url:
+        df = download_data(date_range=date_range,
+                           max_workers=4,
+                           blocks_per_query=7,
+                           subgraph_url=url)
+        assert list(df.block_number) == list(expected.index)
+        assert df.debt.values == approx(expected.debt.values)
+        assert df.RedemptionPrice.astype(float).values == approx(expected.RedemptionPrice.values)
+
+        df = download_data(date_range=date_range,
+                           use_system_totals=False,
+                           subgraph_url=url)
+        assert df.collateral.values == approx(expected.collateral.values)
+
+        cache_path = tmp_path / 'cache'
+        download_data(date_range=date_range,
+                      cache_path=cache_path,
+                      subgraph_url=url)
+
+    # The cached window must be served without reaching the subgraph
+    df = download_data(date_range=date_range,
+                       cache_path=cache_path,
+                       subgraph_url='http://127.0.0.1:9/')
+    assert list(df.block_number) == list(expected.index)
+    assert df.debt.values == approx(expected.debt.values)
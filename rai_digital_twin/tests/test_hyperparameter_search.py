@@ -0,0 +1,43 @@
+from pytest import approx
+import numpy as np
+
+from rai_digital_twin.hyperparameter_search import rolling_origin_search
+from rai_digital_twin.system_identification import fit_predict_action
+from rai_digital_twin.types import ActionState, ControllerState, TokenState, UserActionParams
+
+
+def test_rolling_origin_search():
+    rng = np.random.default_rng(0)
+    states = [ActionState(TokenState(*(rng.random(4) * 10 + 1)),
+                          ControllerState(*(rng.random(4) + 0.5)),
+                          rng.random() + 0.5,
+                          rng.random() + 1.0)
+              for _ in range(50)]
+    params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    results = rolling_origin_search(states,
+                                    alphas=[0.5, 0.8],
+                                    lags=[1, 2],
+                                    action_params=params,
+                                    min_history=40,
+                                    step=3,
+                                    max_workers=2,
+                                    chunk_size=2)
+
+    assert len(results) == 4
+    assert (results.n_folds == 4).all()
+    assert results.score.is_monotonic_increasing
+
+    # Same scores as refitting everything on each fold
+    origins = range(40, 50, 3)
+    token_states = np.array([state.token_state for state in states])
+    real_changes = np.diff(token_states, axis=0)[np.array(origins) - 1]
+    for row in results.itertuples():
+        predicted_changes = np.array([fit_predict_action(states[:origin],
+                                                         params,
+                                                         row.ewm_alpha,
+                                                         row.var_lag,
+                                                         'numpy')
+                                      for origin in origins])
+        scaled_errors = (predicted_changes - real_changes) / real_changes.std(axis=0)
+        rmse = np.sqrt((scaled_errors ** 2).mean(axis=0))
+        assert row.score == approx(rmse.mean())
@@ -0,0 +1,47 @@
+import numpy as np
+
+from rai_digital_twin.ingestion import *
+
+
+def test_extract_nested_column():
+    records = [{'a': {'b': '1.5'}, 'n': '3'},
+               {'a': {'b': '2.5'}, 'n': '4'}]
+    column = extract_column(records, ColumnSpec('b', ('a', 'b')))
+    assert column.dtype == np.float64
+    assert list(column) == [1.5, 2.5]
+
+    column = extract_column(records, ColumnSpec('n', ('n',), np.int64))
+    assert column.dtype == np.int64
+    assert list(column) == [3, 4]
+
+
+def test_null_values_are_nan():
+    records = [{'n': '3'}, {'n': None}]
+    column = extract_column(records, ColumnSpec('n', ('n',), np.int64))
+    assert column[0] == 3
+    assert np.isnan(column[1])
+
+
+def test_column_buffer_growth():
+    schema = (ColumnSpec('x', ('x',)),)
+    pages = [[{'x': str(i)} for i in range(j, j + 3)]
+             for j in range(0, 9, 3)]
+    df = ingest_pages(pages, schema, capacity=2)
+    assert list(df.x) == list(range(9))
+
+    assert len(ingest_pages([], schema)) == 0
+
+
+def test_null_values_across_pages():
+    schema = (ColumnSpec('n', ('n',), np.int64),)
+    pages = [[{'n': '1'}, {'n': None}], [{'n': '2'}]]
+    df = ingest_pages(pages, schema)
+    assert df.n.dtype == np.float64
+    assert df.n[0] == 1
+    assert np.isnan(df.n[1])
+    assert df.n[2] == 2
+
+    # Nulls on a later page
+    df = ingest_pages(pages[::-1], schema)
+    assert list(df.n[:2]) == [2, 1]
+    assert np.isnan(df.n[2])
@@ -1,6 +1,7 @@
 from pytest import approx
 
 from rai_digital_twin.prepare_data import *
+from rai_digital_twin.timeline import TimelineIndex, events_between
 
 
 def test_interpolate():
@@ -19,3 +20,39 @@ def test_interpolate():
                                                height + 3)
         assert interp_timestep == timestep + 1
 
+
+
+def test_timeline_index():
+    heights = {0: 10, 1: 19, 2: 31, 3: 42, 4: 50}
+    timestamps = ['2021-01-01 00:00', '2021-01-01 01:00', '2021-01-01 02:00',
+                  '2021-01-01 03:00', '2021-01-01 04:00']
+    timeline = TimelineIndex.from_heights(heights, timestamps)
+
+    queries = [5, 10, 25, 50, 60]
+    expected = [interpolate_timestep(list(heights.values()), h)
+                for h in queries]
+    assert list(timeline.heights_to_timesteps(queries)) == expected
+    assert timeline.height_to_timestep(31) == 3
+
+    assert timeline.timestamp_to_timestep('2021-01-01 02:30') == 3
+    assert timeline.timestep_range(19, 50) == (2, 5)
+    assert timeline.timestep_range(19, 45) == (2, 5)
+    assert timeline.timestep_range(20, 30) == (2, 3)
+    assert timeline.timestep_range(30, 30) == (2, 2)
+
+    # Same convention as for single heights
+    for (start_height, end_height) in ((19, 50), (19, 45), (20, 30),
+                                       (5, 10), (0, 70), (42, 43), (44, 49)):
+        expected = {timeline.height_to_timestep(height)
+                    for height in range(start_height, end_height)}
+        assert set(range(*timeline.timestep_range(start_height, end_height))) == expected
+
+    events = {0: 'a', 2: 'b', 3: 'c', 5: 'd'}
+    assert events_between(events, 1, 4) == {2: 'b', 3: 'c'}
+
+
+def test_governance_events():
+    heights = {0: 12100000, 1: 12200000, 2: 12300000}
+    events = load_governance_events('data/controller_params.csv', heights)
+    assert 0 in events
+    assert all(0 <= t <= len(heights) for t in events.keys())
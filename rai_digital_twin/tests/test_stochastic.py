@@ -0,0 +1,45 @@
+from pytest import approx, importorskip, raises
+import numpy as np
+
+from rai_digital_twin.stochastic import fit_eth_price, posterior_fit_params, timed_fit_eth_price
+
+
+def test_fit_eth_price():
+    """
+    Make sure that the fast backends recover the gamma parameters.
+    """
+    rng = np.random.default_rng(0)
+    X = rng.gamma(shape=50.0, scale=40.0, size=20_000)
+    for method in ('moments', 'mle'):
+        result = timed_fit_eth_price(X, method)
+        assert result.method == method
+        assert result.wall_seconds >= 0
+        assert type(result.params.shape) == float
+        assert type(result.params.scale) == float
+        assert result.params.shape == approx(50.0, rel=0.05)
+        assert result.params.scale == approx(40.0, rel=0.05)
+
+    with raises(ValueError):
+        fit_eth_price(X, 'unknown')
+
+
+def test_posterior_fit_params():
+    """
+    Make sure that the Bayesian backends give plain floats out of the
+    posterior samples, which are (chain, draw) arrays.
+    """
+    alpha = np.full((2, 100), 4.0)
+    beta = np.full((2, 100), 0.5)
+    params = posterior_fit_params(alpha, beta)
+    assert type(params.shape) == float
+    assert type(params.scale) == float
+    assert (params.shape, params.scale) == approx((4.0, 2.0))
+
+
+def test_bayesian_fit_eth_price():
+    importorskip('pymc3')
+    X = np.random.default_rng(1).gamma(shape=50.0, scale=40.0, size=500)
+    for method in ('advi', 'nuts'):
+        params = fit_eth_price(X, method)
+        assert type(params.shape) == float
+        assert type(params.scale) == float
@@ -1,7 +1,9 @@
 from pytest import approx
 from rai_digital_twin.types import ActionState, ControllerState, TokenState, TransformedTokenState, UserActionParams
-from rai_digital_twin.system_identification import VAR_prediction, fit_predict_action
+from rai_digital_twin.types import coordinate_transform, coordinate_transform_batch, reverse_coordinate_transform_batch
+from rai_digital_twin.system_identification import OnlineVAR, arbitrageur_action, arbitrageur_action_batch, PowerTransformerCache, VAR_information_criteria, VAR_prediction, VAR_prediction_batch, fit_predict_action, fit_predict_action_batch, select_var_lag
 import numpy as np
+from statsmodels.tsa.api import VAR
 
 
 def test_VAR():
@@ -67,3 +69,162 @@ def test_fit_predict():
 
     new_action = fit_predict_action(states, params, 0.8, 1)
     assert type(new_action) == TokenState
+
+
+def test_batch_coordinate_transform():
+    """
+    Make sure that the batch transforms match the per-state ones.
+    """
+    params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    N = 20
+    global_states = np.random.rand(N, 4) * 10 + 1
+    delta_states = np.random.randn(N, 4)
+    controller_states = np.random.rand(N, 4) + 0.5
+    eth_prices = np.random.rand(N) + 1
+
+    transformed = coordinate_transform_batch(delta_states,
+                                             global_states,
+                                             controller_states,
+                                             params,
+                                             eth_prices)
+    assert transformed.shape == (N, 4)
+    for i in range(N):
+        expected = coordinate_transform(TokenState(*delta_states[i]),
+                                        TokenState(*global_states[i]),
+                                        ControllerState(*controller_states[i]),
+                                        params,
+                                        eth_prices[i])
+        assert list(transformed[i]) == approx(list(expected.__dict__.values()))
+
+    reverse = reverse_coordinate_transform_batch(transformed,
+                                                 global_states,
+                                                 controller_states,
+                                                 params,
+                                                 eth_prices)
+    assert reverse == approx(delta_states)
+
+
+def test_online_VAR():
+    """
+    Make sure that the RLS updates give the same forecast as refitting.
+    """
+    Y = np.random.randn(120, 4)
+    for lag in (1, 5):
+        model = OnlineVAR(lag).fit(Y[:60])
+        for y in Y[60:]:
+            model.update(y)
+        assert model.forecast() == approx(VAR_prediction(Y, lag))
+
+    # Forgetting factors discount older observations
+    model = OnlineVAR(2, 0.9).fit(Y[:60])
+    for y in Y[60:]:
+        model.update(y)
+    assert model.forecast() == approx(OnlineVAR(2, 0.9).fit(Y).forecast())
+
+
+def test_numpy_VAR():
+    """
+    Make sure that the NumPy backend matches the statsmodels one.
+    """
+    for lag in (1, 3, 15):
+        errors = np.random.randn(100, 4)
+        expected = VAR_prediction(errors, lag)
+        assert VAR_prediction(errors, lag, 'numpy') == approx(expected)
+
+
+def test_batch_VAR():
+    """
+    Make sure that the batched fit matches fitting every series alone.
+    """
+    rng = np.random.default_rng(0)
+    for lag in (1, 3):
+        errors = rng.standard_normal((5, 60, 4))
+        expected = [VAR_prediction(series, lag, 'numpy') for series in errors]
+        assert VAR_prediction_batch(errors, lag) == approx(np.array(expected))
+
+    rng = np.random.default_rng(1)
+    params = UserActionParams(1.5, 1e6, 0.003, True, 1.0)
+    past_states = [[ActionState(TokenState(*(rng.random(4) * 10 + 1)),
+                                ControllerState(*(rng.random(4) + 0.5)),
+                                rng.random() + 0.5,
+                                rng.random() + 1.0)
+                    for _ in range(40)]
+                   for _ in range(3)]
+    actions = fit_predict_action_batch(past_states, params, 0.8, 2)
+    for (states, action) in zip(past_states, actions):
+        expected = fit_predict_action(states, params, 0.8, 2, 'numpy')
+        assert action == approx(expected)
+
+
+def test_VAR_lag_selection():
+    """
+    Make sure that the nested fits match fitting every lag order with
+    statsmodels on the same sample.
+    """
+    rng = np.random.default_rng(2)
+    errors = rng.standard_normal((300, 4))
+    errors[1:] += 0.5 * errors[:-1]
+    max_lag = 6
+    criteria = VAR_information_criteria(errors, max_lag)
+    for lag in range(1, max_lag + 1):
+        results = VAR(errors[max_lag - lag:]).fit(lag)
+        assert criteria['aic'][lag - 1] == approx(results.aic)
+        assert criteria['bic'][lag - 1] == approx(results.bic)
+        assert criteria['hqic'][lag - 1] == approx(results.hqic)
+        assert criteria['fpe'][lag - 1] == approx(results.fpe)
+
+    expected = VAR(errors).select_order(max_lag).selected_orders
+    for criterion in ('aic', 'bic', 'hqic', 'fpe'):
+        assert select_var_lag(errors, max_lag, criterion) == expected[criterion]
+
+
+def test_power_transformer_cache():
+    errors = np.random.randn(200, 4)
+    cache = PowerTransformerCache(refit_interval=10)
+    cache.fit_transform(errors[:100])
+    transformer = cache.transformer
+
+    # Only refit after `refit_interval` new errors
+    cache.fit_transform(errors[:105])
+    assert cache.transformer is transformer
+    cache.fit_transform(errors[:110])
+    assert cache.transformer is not transformer
+
+    # Or when the transformed errors drift
+    cache = PowerTransformerCache(refit_interval=1000, refit_drift=0.5)
+    cache.fit_transform(errors[:100])
+    transformer = cache.transformer
+    cache.fit_transform(errors[:101])
+    assert cache.transformer is transformer
+    cache.fit_transform(np.vstack([errors[:100], errors[100:] + 5]))
+    assert cache.transformer is not transformer
+
+
+def test_batch_arbitrageur_action():
+    """
+    Make sure that the vectorized action is the same as the scalar one on
+    the borrow, repay and no-op cases.
+    """
+    rng = np.random.default_rng(3)
+    n = 200
+    token_states = rng.random((n, 4)) * 10 + 1
+    redemption_prices = rng.random(n) + 2.5
+    market_prices = redemption_prices * rng.uniform(0.5, 2.0, n)
+    market_prices[:20] = redemption_prices[:20]
+    eth_prices = rng.random(n) * 1000 + 1000
+
+    for consider_liquidation_ratio in (True, False):
+        params = UserActionParams(1.5, 1e6, 0.003,
+                                  consider_liquidation_ratio, 1.0)
+        actions = arbitrageur_action_batch(token_states,
+                                           redemption_prices,
+                                           market_prices,
+                                           eth_prices,
+                                           params)
+        for i in range(n):
+            expected = arbitrageur_action(TokenState(*token_states[i]),
+                                          ControllerState(redemption_prices[i], 1.0, 0.0, 0.0),
+                                          market_prices[i],
+                                          eth_prices[i],
+                                          params)
+            assert actions[i] == approx(np.array(expected))
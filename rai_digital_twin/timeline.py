@@ -0,0 +1,110 @@
+"""
+timeline.py
+
+Sorted index over the block heights (and timestamps) of each timestep, for
+mapping external events into the simulation timeline through binary search.
+"""
+from dataclasses import dataclass
+from typing import Mapping, TypeVar, Union
+import numpy as np
+import pandas as pd
+
+from rai_digital_twin.types import ArrayBacktestingData, BacktestingData
+from rai_digital_twin.types import Height, Timestep, TimestepArray
+
+T = TypeVar('T')
+
+
+def to_unix_seconds(timestamps: object) -> np.ndarray:
+    """
+    Convert datetimes, datetime strings or unix seconds into int64 seconds.
+    """
+    values = np.asarray(timestamps)
+    if np.issubdtype(values.dtype, np.number):
+        return values.astype(np.int64)
+    else:
+        return (pd.to_datetime(values)
+                .to_numpy(dtype='datetime64[s]')
+                .astype(np.int64))
+
+
+@dataclass(frozen=True)
+class TimelineIndex():
+    """
+    Heights and optional unix timestamps per timestep, both ordered.
+
+    The timestep for a height (or timestamp) is the number of timesteps
+    which happen at or before it, as on `prepare_data.interpolate_timestep`.
+    """
+    heights: np.ndarray
+    timestamps: np.ndarray = None
+
+    @classmethod
+    def from_heights(cls,
+                     heights: Mapping[Timestep, Height],
+                     timestamps: object = None) -> 'TimelineIndex':
+        if isinstance(heights, TimestepArray):
+            height_array = heights.array
+        else:
+            height_array = np.fromiter((heights[t] for t in sorted(heights)),
+                                       dtype=np.int64,
+                                       count=len(heights))
+        if timestamps is not None:
+            timestamps = to_unix_seconds(timestamps)
+        return cls(height_array, timestamps)
+
+    @classmethod
+    def from_backtesting_data(cls,
+                              data: Union[BacktestingData, ArrayBacktestingData]) -> 'TimelineIndex':
+        if isinstance(data, ArrayBacktestingData):
+            timestamps = data.exogenous_data.columns['timestamp']
+        else:
+            timestamps = [data.exogenous_data[t]['timestamp']
+                          for t in sorted(data.exogenous_data)]
+        return cls.from_heights(data.heights, timestamps)
+
+    def __len__(self) -> int:
+        return len(self.heights)
+
+    def height_to_timestep(self, height: Height) -> Timestep:
+        return int(np.searchsorted(self.heights, height, side='right'))
+
+    def heights_to_timesteps(self, heights: object) -> np.ndarray:
+        return np.searchsorted(self.heights, np.asarray(heights), side='right')
+
+    def timestamp_to_timestep(self, timestamp: object) -> Timestep:
+        return int(self.timestamps_to_timesteps([timestamp])[0])
+
+    def timestamps_to_timesteps(self, timestamps: object) -> np.ndarray:
+        if self.timestamps is None:
+            raise ValueError("The timeline index has no timestamps")
+        return np.searchsorted(self.timestamps,
+                               to_unix_seconds(timestamps),
+                               side='right')
+
+    def timestep_range(self,
+                       start_height: Height,
+                       end_height: Height) -> tuple[Timestep, Timestep]:
+        """
+        Half-open range of the timesteps onto which `height_to_timestep`
+        maps the heights on [start_height, end_height).
+        """
+        start = self.height_to_timestep(start_height)
+        if end_height <= start_height:
+            return (start, start)
+        else:
+            # Timestep of the last height on the range
+            end = self.height_to_timestep(end_height - 1) + 1
+            return (start, end)
+
+
+def events_between(events: Mapping[Timestep, T],
+                   start: Timestep,
+                   end: Timestep) -> dict[Timestep, T]:
+    """
+    Events which happen on the timesteps [start, end).
+    """
+    timesteps = np.sort(np.fromiter(events.keys(), dtype=np.int64,
+                                    count=len(events)))
+    (i, j) = np.searchsorted(timesteps, [start, end], side='left')
+    return {int(t): events[int(t)] for t in timesteps[i:j]}
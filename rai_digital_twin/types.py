@@ -1,6 +1,8 @@
+from collections.abc import Mapping
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any
+from typing import Any, Callable, Iterator, NamedTuple
+import numpy as np
 import pandas as pd
 
 # Units
@@ -45,8 +47,18 @@ class GovernanceEvent():
     descriptor: dict
 
 
-@dataclass(frozen=True)
-class ControllerParams():
+def shared_on_copy(cls):
+    """
+    Make copies of a immutable type return the instance itself, so that
+    cadCAD doesn't rebuild it when copying the state.
+    """
+    cls.__copy__ = lambda self: self
+    cls.__deepcopy__ = lambda self, memo: self
+    return cls
+
+
+@shared_on_copy
+class ControllerParams(NamedTuple):
     kp: Per_USD
     ki: Per_USD_Seconds
     leaky_factor: Percentage
@@ -54,8 +66,8 @@ class ControllerParams():
     enabled: bool
 
 
-@dataclass(frozen=True)
-class ControllerState():
+@shared_on_copy
+class ControllerState(NamedTuple):
     redemption_price: USD_per_RAI
     redemption_rate: Percentage_Per_Hour
     proportional_error: USD_per_RAI
@@ -72,33 +84,35 @@ class UserActionParams():
 
 
 
-@dataclass(frozen=True)
-class TokenState():
+@shared_on_copy
+class TokenState(NamedTuple):
     rai_reserve: RAI
     eth_reserve: ETH
     rai_debt: RAI
     eth_locked: ETH
 
+    # Make NumPy scalars defer to `__rmul__` rather than broadcasting
+    __array_ufunc__ = None
+
     def __sub__(self, x):
-        return TokenState(self.rai_reserve - x.rai_reserve,
-                            self.eth_reserve - x.eth_reserve,
-                            self.rai_debt - x.rai_debt,
-                            self.eth_locked - x.eth_locked)
-   
+        return TokenState(self[0] - x[0],
+                          self[1] - x[1],
+                          self[2] - x[2],
+                          self[3] - x[3])
 
     def __add__(self, x):
-        return TokenState(self.rai_reserve + x.rai_reserve,
-                            self.eth_reserve + x.eth_reserve,
-                            self.rai_debt + x.rai_debt,
-                            self.eth_locked + x.eth_locked)
-
+        return TokenState(self[0] + x[0],
+                          self[1] + x[1],
+                          self[2] + x[2],
+                          self[3] + x[3])
 
     def __mul__(self, x):
-        return TokenState(self.rai_reserve * x,
-                            self.eth_reserve * x,
-                            self.rai_debt * x,
-                            self.eth_locked * x)
+        return TokenState(self[0] * x,
+                          self[1] * x,
+                          self[2] * x,
+                          self[3] * x)
 
+    __rmul__ = __mul__
 
 
 DeltaTokenState = TokenState    
@@ -130,6 +144,96 @@ class BacktestingData():
     heights: dict[Timestep, Height]
     pid_states: dict[Timestep, ControllerState]
 
+class TimestepColumns(Mapping):
+    """
+    Read-only `dict[Timestep, ...]` view over contiguous columns, on which
+    the value for a timestep is built only when it is accessed. The first
+    row is at the `offset` timestep.
+    """
+
+    def __init__(self,
+                 columns: dict[str, np.ndarray],
+                 record: Callable = dict,
+                 offset: Timestep = 0):
+        self.columns = columns
+        self.record = record
+        self.offset = offset
+        self.size = len(next(iter(columns.values())))
+        for column in columns.values():
+            column.setflags(write=False)
+
+    def position(self, t: Timestep) -> int:
+        i = t - self.offset
+        if 0 <= i < self.size:
+            return i
+        else:
+            raise KeyError(t)
+
+    def __getitem__(self, t: Timestep):
+        i = self.position(t)
+        return self.record(**{name: column[i]
+                              for (name, column) in self.columns.items()})
+
+    def __iter__(self) -> Iterator[Timestep]:
+        return iter(range(self.offset, self.offset + self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __deepcopy__(self, memo):
+        # Immutable, so it can be shared across runs
+        return self
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns,
+                            index=pd.RangeIndex(self.offset,
+                                                self.offset + self.size))
+
+
+class TimestepArray(TimestepColumns):
+    """
+    Read-only `dict[Timestep, ...]` view over a single column.
+    """
+
+    def __init__(self, array: np.ndarray, offset: Timestep = 0):
+        super().__init__({'value': array}, offset=offset)
+        self.array = array
+
+    def __getitem__(self, t: Timestep):
+        return self.array[self.position(t)].item()
+
+
+class TimestepRecords(TimestepColumns):
+    """
+    Read-only `dict[Timestep, ...]` view over a 2D float array, on which
+    each row is a record with the given positional fields.
+    """
+
+    def __init__(self,
+                 array: np.ndarray,
+                 names: tuple[str, ...],
+                 record: Callable,
+                 offset: Timestep = 0):
+        super().__init__(dict(zip(names, array.T)), record, offset)
+        array.setflags(write=False)
+        self.array = array
+
+    def __getitem__(self, t: Timestep):
+        return self.record(*self.array[self.position(t)].tolist())
+
+
+@dataclass(frozen=True)
+class ArrayBacktestingData():
+    """
+    Struct-of-arrays variant of `BacktestingData`, on which every attribute
+    is a timestep-indexed view over contiguous NumPy columns.
+    """
+    token_states: TimestepRecords
+    exogenous_data: TimestepColumns
+    heights: TimestepArray
+    pid_states: TimestepRecords
+
+
 @dataclass(frozen=True)
 class OptimalAction():
     borrow: RAI
@@ -197,5 +301,64 @@ def reverse_coordinate_transform(transformed_state: TransformedTokenState,
     return TokenState(r, z, d, q)
 
 
+def coordinate_transform_batch(delta_states: np.ndarray,
+                               global_states: np.ndarray,
+                               controller_states: np.ndarray,
+                               params: UserActionParams,
+                               eth_prices: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `coordinate_transform` over arrays of states.
+
+    Token states are arrays with the `TokenState` fields on the last axis,
+    controller states with the `ControllerState` fields, and the output has
+    the `TransformedTokenState` fields on the last axis.
+    """
+    delta_states = np.asarray(delta_states, dtype=float)
+    global_states = np.asarray(global_states, dtype=float)
+    redemption_prices = np.asarray(controller_states, dtype=float)[..., 0]
+
+    liquidation_prices = params.liquidation_ratio * redemption_prices
+    liquidation_prices = liquidation_prices / np.asarray(eth_prices, dtype=float)
+
+    global_liquidation_surplus = liquidation_prices * global_states[..., 2]
+    global_liquidation_surplus -= global_states[..., 3]
+
+    delta_liquidation_surplus = liquidation_prices * delta_states[..., 2]
+    delta_liquidation_surplus -= delta_states[..., 3]
+
+    return np.stack([delta_states[..., 2] / params.debt_ceiling,
+                     delta_liquidation_surplus / global_liquidation_surplus,
+                     delta_states[..., 0] / global_states[..., 0],
+                     delta_states[..., 1] / global_states[..., 1]],
+                    axis=-1)
+
+
+def reverse_coordinate_transform_batch(transformed_states: np.ndarray,
+                                       global_states: np.ndarray,
+                                       controller_states: np.ndarray,
+                                       params: UserActionParams,
+                                       eth_prices: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `reverse_coordinate_transform` over arrays of states, with
+    the same layout as `coordinate_transform_batch`.
+    """
+    transformed_states = np.asarray(transformed_states, dtype=float)
+    global_states = np.asarray(global_states, dtype=float)
+    redemption_prices = np.asarray(controller_states, dtype=float)[..., 0]
+
+    d = transformed_states[..., 0] * params.debt_ceiling
+
+    # Liquidation Price
+    l_p = params.liquidation_ratio * redemption_prices
+    l_p = l_p / np.asarray(eth_prices, dtype=float)
+    beta = transformed_states[..., 1]
+    q = l_p * (d - beta * global_states[..., 2])
+    q += beta * global_states[..., 3]
+
+    r = transformed_states[..., 2] * global_states[..., 0]
+    z = transformed_states[..., 3] * global_states[..., 1]
+    return np.stack([r, z, d, q], axis=-1)
+
+
 def transformed_token_states_to_numpy(token_states: list[TransformedTokenState]):
     return pd.DataFrame(token_states).values